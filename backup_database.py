@@ -2,6 +2,9 @@ import sqlite3
 import os
 from datetime import datetime
 
+# Copy this many pages per backup step; between steps the bot can keep writing
+BACKUP_PAGES_PER_STEP = 1000
+
 def backup_database():
     """Backup SQLite database to a file that persists on Render's ephemeral storage."""
     source_db = 'users.db'
@@ -14,11 +17,12 @@ def backup_database():
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     backup_file = f'{backup_dir}/users_backup_{timestamp}.db'
     
-    # Copy database
-    source = sqlite3.connect(source_db)
+    # Copy database with SQLite's online backup API (consistent even mid-write),
+    # in steps so the source isn't locked for the whole copy
+    source = sqlite3.connect(f'file:{source_db}?mode=ro', uri=True)
     backup = sqlite3.connect(backup_file)
     
-    source.backup(backup)
+    source.backup(backup, pages=BACKUP_PAGES_PER_STEP)
     
     source.close()
     backup.close()
@@ -31,6 +35,8 @@ def backup_database():
         for old_backup in backups[:-7]:
             os.remove(os.path.join(backup_dir, old_backup))
             print(f"🗑️  Deleted old backup: {old_backup}")
+    
+    return backup_file
 
 if __name__ == '__main__':
     backup_database()
\ No newline at end of file
@@ -1,9 +1,5 @@
 import logging
-import json
-import os
 import atexit
-import sqlite3
-from threading import Lock
 from telegram import Update, ReplyKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 from config import Config
@@ -16,173 +12,11 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Database connection
-DB_PATH = 'users.db'
-
-def init_database():
-    """Initialize database tables."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id TEXT PRIMARY KEY,
-            language TEXT DEFAULT 'en',
-            city TEXT,
-            rain_alerts INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Rain alerts log (per evitare duplicati)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS rain_alerts_log (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT,
-            city TEXT,
-            alert_time TIMESTAMP,
-            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
-    logger.info("✅ Database initialized")
-
-def get_user_language(user_id):
-    """Get user's preferred language."""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('SELECT language FROM users WHERE user_id = ?', (str(user_id),))
-        result = cursor.fetchone()
-        conn.close()
-        return result[0] if result else 'en'
-    except Exception as e:
-        logger.error(f"Error getting user language: {e}")
-        return 'en'
-
-def set_user_language(user_id, lang):
-    """Set user's language preference."""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Check if user exists
-        cursor.execute('SELECT 1 FROM users WHERE user_id = ?', (str(user_id),))
-        exists = cursor.fetchone()
-        
-        if exists:
-            # Update existing user
-            cursor.execute('''
-                UPDATE users 
-                SET language = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE user_id = ?
-            ''', (lang, str(user_id)))
-        else:
-            # Create new user
-            cursor.execute('''
-                INSERT INTO users (user_id, language)
-                VALUES (?, ?)
-            ''', (str(user_id), lang))
-        
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        logger.error(f"Error setting user language: {e}")
-        return False
-
-def get_user_city(user_id):
-    """Get user's saved city."""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('SELECT city FROM users WHERE user_id = ?', (str(user_id),))
-        result = cursor.fetchone()
-        conn.close()
-        return result[0] if result else None
-    except Exception as e:
-        logger.error(f"Error getting user city: {e}")
-        return None
-
-def save_user_city(user_id, city):
-    """Save user's city."""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Check if user exists
-        cursor.execute('SELECT 1 FROM users WHERE user_id = ?', (str(user_id),))
-        exists = cursor.fetchone()
-        
-        if exists:
-            # Update existing user
-            cursor.execute('''
-                UPDATE users 
-                SET city = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE user_id = ?
-            ''', (city, str(user_id)))
-        else:
-            # Create new user
-            cursor.execute('''
-                INSERT INTO users (user_id, city)
-                VALUES (?, ?)
-            ''', (str(user_id), city))
-        
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        logger.error(f"Error saving user city: {e}")
-        return False
-
-def get_rain_alerts_status(user_id):
-    """Get user's rain alerts status."""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('SELECT rain_alerts FROM users WHERE user_id = ?', (str(user_id),))
-        result = cursor.fetchone()
-        conn.close()
-        return bool(result[0]) if result else False
-    except Exception as e:
-        logger.error(f"Error getting rain alerts status: {e}")
-        return False
-
-def set_rain_alerts_status(user_id, status):
-    """Set user's rain alerts status."""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Check if user exists
-        cursor.execute('SELECT 1 FROM users WHERE user_id = ?', (str(user_id),))
-        exists = cursor.fetchone()
-        
-        if exists:
-            # Update existing user
-            cursor.execute('''
-                UPDATE users 
-                SET rain_alerts = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE user_id = ?
-            ''', (1 if status else 0, str(user_id)))
-        else:
-            # Create new user
-            cursor.execute('''
-                INSERT INTO users (user_id, rain_alerts)
-                VALUES (?, ?)
-            ''', (str(user_id), 1 if status else 0))
-        
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        logger.error(f"Error setting rain alerts status: {e}")
-        return False
+# User preferences (SQLite, shared with the webhook server)
+from user_prefs import (
+    get_user_language, set_user_language, get_user_city,
+    get_rain_alerts_status, set_rain_alerts_status, update_user_prefs
+)
 
 # ========== COMMAND HANDLERS ==========
 
@@ -277,11 +111,8 @@ async def save_city_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         city = ' '.join(context.args)
         
-        # Save city
-        save_user_city(user_id, city)
-        
-        # Auto-enable rain alerts when saving a city
-        set_rain_alerts_status(user_id, True)
+        # Save city and auto-enable rain alerts in one write
+        update_user_prefs(user_id, city=city, rain_alerts=True)
         
         success_msg = {
             'en': f"✅ Your city '{city}' has been saved!\n\n"
@@ -466,6 +297,39 @@ async def rain_alerts_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         }
         await update.message.reply_text(error_msg[get_user_language(update.effective_user.id)])
 
+# Reply-keyboard buttons that run a command handler
+BUTTON_COMMANDS = {
+    "🇬🇧 English": handle_language_choice,
+    "🇮🇹 Italiano": handle_language_choice,
+    "📍 My City / Mia Città": my_weather_command,
+    "🔔 Rain Notif / Notif Pioggia": rain_alerts_command,
+    "🌐 Language / Lingua": language_command,
+}
+
+# Reply-keyboard buttons that just ask for a city
+BUTTON_PROMPTS = {
+    "🌤️ Weather / Meteo": {
+        'en': "Send me a city name for the full weather forecast.\n\n"
+              "Or use /myweather for your saved city.",
+        'it': "Inviami il nome di una città per le previsioni complete.\n\n"
+              "O usa /miometeo per la tua città salvata."
+    },
+    "💾 Save City / Salva Città": {
+        'en': "Send me the city you want to save.\n\n"
+              "Example: Rome\n"
+              "Or use: /savecity Rome",
+        'it': "Inviami la città che vuoi salvare.\n\n"
+              "Esempio: Roma\n"
+              "O usa: /salvacitta Roma"
+    },
+    "🌧️ Rain Alert / Allerta Pioggia": {
+        'en': "Send me a city name for detailed rain alerts.\n\n"
+              "Or use /myrain for your saved city.",
+        'it': "Inviami il nome di una città per avvisi pioggia dettagliati.\n\n"
+              "O usa /miapioggia per la tua città salvata."
+    },
+}
+
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle regular text messages."""
     try:
@@ -473,61 +337,17 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         lang = get_user_language(user_id)
         text = update.message.text.strip()
         
-        # Handle language choice
-        if text in ["🇬🇧 English", "🇮🇹 Italiano"]:
-            await handle_language_choice(update, context)
-            return
-        
-        # Handle weather button
-        if text in ["🌤️ Weather / Meteo"]:
-            prompt = {
-                'en': "Send me a city name for the full weather forecast.\n\n"
-                      "Or use /myweather for your saved city.",
-                'it': "Inviami il nome di una città per le previsioni complete.\n\n"
-                      "O usa /miometeo per la tua città salvata."
-            }
-            await update.message.reply_text(prompt[lang])
-            return
-        
-        # Handle my city button
-        if text in ["📍 My City / Mia Città"]:
-            await my_weather_command(update, context)
-            return
-        
-        # Handle save city button
-        if text in ["💾 Save City / Salva Città"]:
-            prompt = {
-                'en': "Send me the city you want to save.\n\n"
-                      "Example: Rome\n"
-                      "Or use: /savecity Rome",
-                'it': "Inviami la città che vuoi salvare.\n\n"
-                      "Esempio: Roma\n"
-                      "O usa: /salvacitta Roma"
-            }
-            await update.message.reply_text(prompt[lang])
+        # Keyboard buttons: one dict lookup instead of a chain of comparisons
+        handler = BUTTON_COMMANDS.get(text)
+        if handler:
+            await handler(update, context)
             return
         
-        # Handle rain alert button
-        if text in ["🌧️ Rain Alert / Allerta Pioggia"]:
-            prompt = {
-                'en': "Send me a city name for detailed rain alerts.\n\n"
-                      "Or use /myrain for your saved city.",
-                'it': "Inviami il nome di una città per avvisi pioggia dettagliati.\n\n"
-                      "O usa /miapioggia per la tua città salvata."
-            }
+        prompt = BUTTON_PROMPTS.get(text)
+        if prompt:
             await update.message.reply_text(prompt[lang])
             return
         
-        # Handle rain notifications button
-        if text in ["🔔 Rain Notif / Notif Pioggia"]:
-            await rain_alerts_command(update, context)
-            return
-        
-        # Handle language change button
-        if text in ["🌐 Language / Lingua"]:
-            await language_command(update, context)
-            return
-        
         # If it's a short text, assume it's a city name
         if len(text) < 50:
             await process_weather_request(update, text, user_id, lang, show_rain_prompt=True)
@@ -720,9 +540,6 @@ def main():
         logger.error("ERROR: BOT_TOKEN not found. Please check your .env file.")
         return
     
-    # Initialize database
-    init_database()
-    
     # Register cleanup
     atexit.register(cleanup)
     
@@ -27,6 +27,9 @@ class Config:
     # Admin user ID for notifications
     ADMIN_USER_ID = os.getenv('ADMIN_USER_ID')
     
+    # Bot username (without @), used to recognise /command@BotName in groups
+    BOT_USERNAME = os.getenv('BOT_USERNAME', '').lstrip('@')
+    
     # Timezone settings
     TIMEZONE = 'Europe/Rome'
     
@@ -1,17 +1,100 @@
 import sqlite3
 import os
-from datetime import datetime
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Read-only connections kept open between calls; sized for every thread that
+# may read at once (update workers, cron jobs, gunicorn request threads) so
+# connections aren't closed and reopened under load
+READ_POOL_SIZE = 16
+
+# Background upkeep for long-running processes: refresh planner statistics
+# every interval, truncate the WAL file every few intervals
+MAINTENANCE_INTERVAL = 15 * 60  # 15 minutes
+CHECKPOINT_EVERY = 4  # intervals (1 hour)
 
 class UserDatabase:
+    """SQLite store for users and sent rain alerts.
+    
+    Reads run in parallel on pooled read-only connections and never take
+    self.lock; it only serializes use of the single writer connection.
+    """
+    
     def __init__(self, db_path='users.db'):
         self.db_path = db_path
+        # One writer connection (SQLite allows one writer at a time anyway)
+        # and a pool of read-only connections, all reused across calls
+        self.lock = threading.Lock()
+        self._writer_conn = None
+        # Plain list used as a stack: pop()/append() are atomic, so checking
+        # out a reader takes no lock at all (queue.LifoQueue would)
+        self._read_pool = []
         self.init_database()
     
+    def _connect(self, readonly=False):
+        """Open a connection with the per-connection settings applied."""
+        if readonly:
+            conn = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True,
+                                   timeout=5, check_same_thread=False)
+            # Rows convert to dicts in C and still unpack like tuples
+            conn.row_factory = sqlite3.Row
+        else:
+            conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+        # WAL only needs fsync at checkpoints; NORMAL is safe there
+        conn.execute('PRAGMA synchronous=NORMAL')
+        # Wait for a busy writer instead of failing with "database is locked"
+        conn.execute('PRAGMA busy_timeout=5000')
+        # ~20MB page cache, temp tables in RAM, reads through mmap
+        conn.execute('PRAGMA cache_size=-20000')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA mmap_size=268435456')
+        conn.execute('PRAGMA foreign_keys=ON')
+        return conn
+    
+    @contextmanager
+    def _reader(self):
+        """Check out a pooled read-only connection."""
+        try:
+            conn = self._read_pool.pop()
+        except IndexError:
+            conn = self._connect(readonly=True)
+        try:
+            yield conn
+        finally:
+            # Racing returns may overshoot the size by a connection or two; harmless
+            if len(self._read_pool) < READ_POOL_SIZE:
+                self._read_pool.append(conn)
+            else:
+                conn.close()
+    
+    @contextmanager
+    def _writer(self):
+        """Use the shared writer connection; commits on success, rolls back on error."""
+        with self.lock:
+            if self._writer_conn is None:
+                self._writer_conn = self._connect()
+            conn = self._writer_conn
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    
     def init_database(self):
         """Initialize database tables."""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
+        # WAL lets readers and the writer work concurrently; it is stored in
+        # the database file, so only switch once
+        cursor.execute('PRAGMA journal_mode')
+        if cursor.fetchone()[0].lower() != 'wal':
+            cursor.execute('PRAGMA journal_mode=WAL')
+        
         # Users table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -36,184 +119,326 @@ class UserDatabase:
             )
         ''')
         
+        # Partial index holding exactly the rain alert recipients, so the
+        # cron query reads that short list instead of scanning every user.
+        # It carries every column the query reads (rain_alerts included, the
+        # planner wants it to count as covering), so the table isn't touched.
+        cursor.execute('DROP INDEX IF EXISTS idx_users_rain_alerts')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_users_rain_alerts_cover
+            ON users(user_id, city, language, rain_alerts)
+            WHERE rain_alerts = 1 AND city IS NOT NULL AND city != ''
+        ''')
+        
+        # Saved cities in order: the city distribution is grouped straight
+        # off this index, no temp B-tree
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_users_city
+            ON users(city)
+            WHERE city IS NOT NULL AND city != ''
+        ''')
+        
+        # Geocoding results (city coordinates never change), kept across restarts
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS geocache (
+                name TEXT PRIMARY KEY,
+                lat REAL,
+                lon REAL,
+                region TEXT
+            )
+        ''')
+        
+        # Per-user alert history, newest first: cooldown check and recent alerts
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_rain_log_user_sent
+            ON rain_alerts_log(user_id, sent_at DESC)
+        ''')
+        
         conn.commit()
-        conn.close()
+        # Gather statistics for the new schema/indexes where useful
+        cursor.execute('PRAGMA optimize=0x10002')
+        # Already tuned by _connect(): keep it as the writer instead of reopening
+        self._writer_conn = conn
+    
+    def run_maintenance(self, checkpoint=False):
+        """Refresh query planner statistics; optionally checkpoint and truncate the WAL."""
+        with self._writer() as conn:
+            conn.execute('PRAGMA optimize')
+            if checkpoint:
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    
+    def start_maintenance(self):
+        """Run run_maintenance() every MAINTENANCE_INTERVAL seconds in a daemon timer."""
+        def tick(count):
+            try:
+                self.run_maintenance(checkpoint=count % CHECKPOINT_EVERY == 0)
+            except Exception:
+                # Daemon timer thread: log it, a print would be lost under gunicorn
+                logger.exception("❌ Database maintenance failed")
+            schedule(count + 1)
+        
+        def schedule(count):
+            timer = threading.Timer(MAINTENANCE_INTERVAL, tick, args=(count,))
+            timer.daemon = True
+            timer.start()
+        
+        schedule(1)
+    
+    def ping(self):
+        """Check that a pooled reader can query the users table."""
+        with self._reader() as conn:
+            conn.execute('SELECT 1 FROM users LIMIT 1').fetchone()
+        return True
     
     def get_user(self, user_id):
         """Get user data."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (str(user_id),))
-        user = cursor.fetchone()
-        conn.close()
-        
-        if user:
-            return {
-                'user_id': user[0],
-                'language': user[1],
-                'city': user[2],
-                'rain_alerts': bool(user[3]),
-                'created_at': user[4],
-                'updated_at': user[5]
-            }
-        return None
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM users WHERE user_id = ?', (str(user_id),))
+            row = cursor.fetchone()
+        
+        if row is None:
+            return None
+        user = dict(row)
+        user['rain_alerts'] = bool(user['rain_alerts'])
+        return user
     
     def create_or_update_user(self, user_id, language='en', city=None, rain_alerts=False):
         """Create or update user data."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Check if user exists
-        cursor.execute('SELECT 1 FROM users WHERE user_id = ?', (str(user_id),))
-        exists = cursor.fetchone()
-        
-        if exists:
-            # Update existing user
-            cursor.execute('''
-                UPDATE users 
-                SET language = ?, city = ?, rain_alerts = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE user_id = ?
-            ''', (language, city, 1 if rain_alerts else 0, str(user_id)))
-        else:
-            # Create new user
-            cursor.execute('''
+        # Single atomic upsert instead of SELECT then UPDATE/INSERT
+        with self._writer() as conn:
+            conn.execute('''
                 INSERT INTO users (user_id, language, city, rain_alerts)
                 VALUES (?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    language = excluded.language,
+                    city = excluded.city,
+                    rain_alerts = excluded.rain_alerts,
+                    updated_at = CURRENT_TIMESTAMP
             ''', (str(user_id), language, city, 1 if rain_alerts else 0))
+        return True
+    
+    def import_users(self, users):
+        """Insert (user_id, language, city, rain_alerts) rows for users not in the table yet.
         
-        conn.commit()
-        conn.close()
+        Existing rows are left untouched: imported data is older than what the
+        bot has written since. Returns the number of rows inserted.
+        """
+        with self._writer() as conn:
+            before = conn.total_changes
+            conn.executemany('''
+                INSERT INTO users (user_id, language, city, rain_alerts)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(user_id) DO NOTHING
+            ''', [(str(user_id), language, city, 1 if rain_alerts else 0)
+                  for user_id, language, city, rain_alerts in users])
+            inserted = conn.total_changes - before
+        return inserted
+    
+    def update_user(self, user_id, language=None, city=None, rain_alerts=None):
+        """Update several user fields in one statement (None = keep current value)."""
+        if rain_alerts is not None:
+            rain_alerts = 1 if rain_alerts else 0
+        with self._writer() as conn:
+            conn.execute('''
+                INSERT INTO users (user_id, language, city, rain_alerts)
+                VALUES (?, COALESCE(?, 'en'), ?, COALESCE(?, 0))
+                ON CONFLICT(user_id) DO UPDATE SET
+                    language = COALESCE(?, language),
+                    city = COALESCE(?, city),
+                    rain_alerts = COALESCE(?, rain_alerts),
+                    updated_at = CURRENT_TIMESTAMP
+            ''', (str(user_id), language, city, rain_alerts, language, city, rain_alerts))
+        return True
+    
+    # Single-column upserts; column names come from this code, never from input
+    def _set_column(self, user_id, column, value):
+        """Set one column for a user, creating the row if needed."""
+        with self._writer() as conn:
+            conn.execute(f'''
+                INSERT INTO users (user_id, {column}) VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    {column} = excluded.{column},
+                    updated_at = CURRENT_TIMESTAMP
+            ''', (str(user_id), value))
         return True
     
     def set_user_language(self, user_id, language):
         """Set user language."""
-        user = self.get_user(user_id)
-        if user:
-            return self.create_or_update_user(
-                user_id, language, user.get('city'), user.get('rain_alerts', False)
-            )
-        else:
-            return self.create_or_update_user(user_id, language)
+        return self._set_column(user_id, 'language', language)
     
     def set_user_city(self, user_id, city):
         """Set user city."""
-        user = self.get_user(user_id)
-        if user:
-            return self.create_or_update_user(
-                user_id, user.get('language', 'en'), city, user.get('rain_alerts', False)
-            )
-        else:
-            return self.create_or_update_user(user_id, city=city)
+        return self._set_column(user_id, 'city', city)
     
     def set_rain_alerts(self, user_id, enabled):
         """Enable/disable rain alerts."""
-        user = self.get_user(user_id)
-        if user:
-            return self.create_or_update_user(
-                user_id, user.get('language', 'en'), user.get('city'), enabled
-            )
-        else:
-            return self.create_or_update_user(user_id, rain_alerts=enabled)
+        return self._set_column(user_id, 'rain_alerts', 1 if enabled else 0)
     
     def log_rain_alert(self, user_id, city):
         """Log a rain alert sent to user."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO rain_alerts_log (user_id, city, alert_time)
-            VALUES (?, ?, CURRENT_TIMESTAMP)
-        ''', (str(user_id), city))
-        conn.commit()
-        conn.close()
+        return self.log_rain_alerts([(user_id, city)])
+    
+    def log_rain_alerts(self, alerts):
+        """Log many sent rain alerts, given as (user_id, city) pairs, in one transaction."""
+        with self._writer() as conn:
+            conn.executemany('''
+                INSERT INTO rain_alerts_log (user_id, city, alert_time)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+            ''', [(str(user_id), city) for user_id, city in alerts])
         return True
     
     def get_recent_rain_alerts(self, user_id, hours=24):
         """Get recent rain alerts for a user."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT city, alert_time, sent_at
-            FROM rain_alerts_log 
-            WHERE user_id = ? 
-            AND datetime(sent_at) > datetime('now', ?)
-            ORDER BY sent_at DESC
-        ''', (str(user_id), f'-{hours} hours'))
-        alerts = cursor.fetchall()
-        conn.close()
-        
-        return [
-            {'city': a[0], 'alert_time': a[1], 'sent_at': a[2]}
-            for a in alerts
-        ]
+        # Compare the bare sent_at column so idx_rain_log_user_sent is used
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT city, alert_time, sent_at
+                FROM rain_alerts_log 
+                WHERE user_id = ? 
+                AND sent_at > datetime('now', ?)
+                ORDER BY sent_at DESC
+            ''', (str(user_id), f'-{hours} hours'))
+            alerts = cursor.fetchall()
+        
+        return [dict(a) for a in alerts]
     
     def should_send_rain_alert(self, user_id, cooldown_hours=6):
         """Check if we should send rain alert (cooldown)."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT sent_at 
-            FROM rain_alerts_log 
-            WHERE user_id = ? 
-            ORDER BY sent_at DESC 
-            LIMIT 1
-        ''', (str(user_id),))
-        last_alert = cursor.fetchone()
-        conn.close()
-        
-        if not last_alert:
-            return True
-        
-        # Calculate hours since last alert
-        last_time = datetime.fromisoformat(last_alert[0].replace('Z', '+00:00'))
-        hours_since = (datetime.utcnow() - last_time).total_seconds() / 3600
+        # Clock arithmetic in SQLite on the bare sent_at column (one index probe
+        # on idx_rain_log_user_sent), no timestamp parsing in Python
+        with self._reader() as conn:
+            allowed, = conn.execute('''
+                SELECT NOT EXISTS (
+                    SELECT 1
+                    FROM rain_alerts_log
+                    WHERE user_id = ?
+                    AND sent_at > datetime('now', ?)
+                )
+            ''', (str(user_id), f'-{cooldown_hours} hours')).fetchone()
         
-        return hours_since >= cooldown_hours
+        return bool(allowed)
+    
+    def get_geocode(self, name):
+        """Get cached (lat, lon, region) for a normalized city name, or None."""
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT lat, lon, region FROM geocache WHERE name = ?', (name,))
+            return cursor.fetchone()
+    
+    def save_geocode(self, name, lat, lon, region):
+        """Store geocoding result for a normalized city name."""
+        # Upsert in place; OR REPLACE would delete and reinsert the row
+        with self._writer() as conn:
+            conn.execute('''
+                INSERT INTO geocache (name, lat, lon, region)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET
+                    lat = excluded.lat,
+                    lon = excluded.lon,
+                    region = excluded.region
+            ''', (name, lat, lon, region))
+        return True
     
     def get_all_users_with_cities(self):
         """Get all users with saved cities."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id, city FROM users WHERE city IS NOT NULL')
-        users = cursor.fetchall()
-        conn.close()
+        with self._reader() as conn:
+            users = conn.execute("SELECT user_id, city FROM users WHERE city IS NOT NULL AND city != ''").fetchall()
         
         return {str(user[0]): user[1] for user in users}
     
     def get_all_users_with_rain_alerts(self):
         """Get all users with rain alerts enabled."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id FROM users WHERE rain_alerts = 1 AND city IS NOT NULL')
-        users = cursor.fetchall()
-        conn.close()
+        with self._reader() as conn:
+            users = conn.execute("SELECT user_id FROM users WHERE rain_alerts = 1 AND city IS NOT NULL AND city != ''").fetchall()
         
         return {str(user[0]): True for user in users}
     
+    def get_rain_alert_candidates(self, cooldown_hours=6):
+        """Get (user_id, city, language) for users with rain alerts on and none sent within cooldown_hours."""
+        # Recipients come through the partial index idx_users_rain_alerts_cover, the
+        # last alert of each through idx_rain_log_user_sent; the cooldown is
+        # applied here so users in pause never leave SQLite
+        with self._reader() as conn:
+            return conn.execute('''
+                SELECT u.user_id, u.city, u.language
+                FROM users u
+                LEFT JOIN rain_alerts_log l ON l.user_id = u.user_id
+                WHERE u.rain_alerts = 1 AND u.city IS NOT NULL AND u.city != ''
+                GROUP BY u.user_id
+                HAVING MAX(l.sent_at) IS NULL OR MAX(l.sent_at) <= datetime('now', ?)
+            ''', (f'-{cooldown_hours} hours',)).fetchall()
+    
+    def get_city_language_groups(self):
+        """Get users with a saved city grouped as {(city, language): [user_id, ...]}."""
+        with self._reader() as conn:
+            groups = conn.execute('''
+                SELECT city, COALESCE(language, 'en'), group_concat(user_id)
+                FROM users
+                WHERE city IS NOT NULL AND city != ''
+                GROUP BY city, COALESCE(language, 'en')
+            ''').fetchall()
+        # user_id is numeric text, so ',' is a safe separator
+        return {(city, lang): user_ids.split(',') for city, lang, user_ids in groups}
+    
     def get_stats(self):
         """Get database statistics."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT COUNT(*) FROM users')
-        total_users = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM users WHERE city IS NOT NULL')
-        users_with_cities = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM users WHERE rain_alerts = 1')
-        users_with_alerts = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM rain_alerts_log')
-        total_alerts = cursor.fetchone()[0]
-        
-        conn.close()
+        # One pass over users with conditional sums, plus the log row count
+        with self._reader() as conn:
+            total_users, users_with_cities, users_with_alerts, total_alerts = conn.execute('''
+                SELECT COUNT(*),
+                       SUM(city IS NOT NULL AND city != ''),
+                       SUM(rain_alerts = 1),
+                       (SELECT COUNT(*) FROM rain_alerts_log)
+                FROM users
+            ''').fetchone()
         
         return {
             'total_users': total_users,
-            'users_with_cities': users_with_cities,
-            'users_with_rain_alerts': users_with_alerts,
+            'users_with_cities': users_with_cities or 0,
+            'users_with_rain_alerts': users_with_alerts or 0,
             'total_rain_alerts_sent': total_alerts
         }
 
+    def get_usage_stats(self):
+        """Get the get_stats() counts, anonymized city/language distribution and recent activity."""
+        # One statement, one round trip: rows are told apart by the first column.
+        # updated_at is CURRENT_TIMESTAMP text, so it compares as is, no datetime() per row
+        with self._reader() as conn:
+            rows = conn.execute('''
+                SELECT 'users', NULL, COUNT(*),
+                       SUM(city IS NOT NULL AND city != ''),
+                       SUM(rain_alerts = 1),
+                       SUM(updated_at > datetime('now', '-1 day'))
+                FROM users
+                UNION ALL
+                SELECT 'alerts', NULL, COUNT(*), NULL, NULL, NULL FROM rain_alerts_log
+                UNION ALL
+                SELECT 'city', city, COUNT(*), NULL, NULL, NULL
+                FROM users WHERE city IS NOT NULL AND city != ''
+                GROUP BY city
+                UNION ALL
+                SELECT 'language', language, COUNT(*), NULL, NULL, NULL
+                FROM users GROUP BY language
+                ORDER BY 3 DESC
+            ''').fetchall()
+        
+        stats = {'city_distribution': [], 'languages': []}
+        for kind, name, count, with_cities, with_alerts, recent in rows:
+            if kind == 'users':
+                stats['total_users'] = count
+                stats['users_with_cities'] = with_cities or 0
+                stats['users_with_rain_alerts'] = with_alerts or 0
+                stats['recently_active_users'] = recent or 0
+            elif kind == 'alerts':
+                stats['total_rain_alerts_sent'] = count
+            elif kind == 'city':
+                stats['city_distribution'].append((name, count))
+            else:
+                stats['languages'].append((name, count))
+        
+        return stats
+
 # Global database instance (for compatibility)
 db = UserDatabase()
\ No newline at end of file
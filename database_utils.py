@@ -2,23 +2,21 @@
 Database utilities for weather bot.
 All modules should use these functions to access the database.
 This ensures consistent database access across webhook and cron jobs.
+
+They delegate to the shared UserDatabase instance, so every call reuses its
+pooled, already-tuned connections (and their statement caches) instead of
+opening users.db afresh.
 """
 
-import sqlite3
 import logging
+from database import db
 
 logger = logging.getLogger(__name__)
 
 def get_all_users_with_cities():
     """Get all users with saved cities from SQLite database."""
     try:
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id, city FROM users WHERE city IS NOT NULL AND city != ""')
-        users = cursor.fetchall()
-        conn.close()
-        
-        return {str(user[0]): user[1] for user in users}
+        return db.get_all_users_with_cities()
     except Exception as e:
         logger.error(f"Error getting users from database: {e}")
         return {}
@@ -26,13 +24,7 @@ def get_all_users_with_cities():
 def get_all_users_with_rain_alerts():
     """Get all users with rain alerts enabled."""
     try:
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id FROM users WHERE rain_alerts = 1 AND city IS NOT NULL')
-        users = cursor.fetchall()
-        conn.close()
-        
-        return {str(user[0]): True for user in users}
+        return db.get_all_users_with_rain_alerts()
     except Exception as e:
         logger.error(f"Error getting users with rain alerts: {e}")
         return {}
@@ -40,13 +32,8 @@ def get_all_users_with_rain_alerts():
 def get_user_language(user_id):
     """Get user language."""
     try:
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT language FROM users WHERE user_id = ?', (str(user_id),))
-        result = cursor.fetchone()
-        conn.close()
-        
-        return result[0] if result else 'en'
+        user = db.get_user(user_id)
+        return user['language'] if user else 'en'
     except Exception as e:
         logger.error(f"Error getting user language: {e}")
         return 'en'
@@ -54,13 +41,8 @@ def get_user_language(user_id):
 def get_user_city(user_id):
     """Get user city."""
     try:
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT city FROM users WHERE user_id = ?', (str(user_id),))
-        result = cursor.fetchone()
-        conn.close()
-        
-        return result[0] if result else None
+        user = db.get_user(user_id)
+        return user['city'] if user else None
     except Exception as e:
         logger.error(f"Error getting user city: {e}")
         return None
@@ -68,29 +50,7 @@ def get_user_city(user_id):
 def get_database_stats():
     """Get database statistics."""
     try:
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT COUNT(*) FROM users')
-        total_users = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM users WHERE city IS NOT NULL')
-        users_with_cities = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM users WHERE rain_alerts = 1')
-        users_with_alerts = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM rain_alerts_log')
-        total_alerts = cursor.fetchone()[0]
-        
-        conn.close()
-        
-        return {
-            'total_users': total_users,
-            'users_with_cities': users_with_cities,
-            'users_with_rain_alerts': users_with_alerts,
-            'total_rain_alerts_sent': total_alerts
-        }
+        return db.get_stats()
     except Exception as e:
         logger.error(f"Error getting database stats: {e}")
-        return {}
\ No newline at end of file
+        return {}
@@ -2,35 +2,105 @@
 Rain Alerts Tracker
 """
 
-import json
 import os
+import orjson
 from datetime import datetime, timedelta
-from threading import Lock
+from threading import RLock
 
+# Compacted snapshot, plus a journal of alerts sent since it was written.
+# Marking an alert appends one line instead of rewriting the whole snapshot.
 TRACKER_FILE = 'rain_alerts_sent.json'
-TRACKER_LOCK = Lock()
+TRACKER_JOURNAL = 'rain_alerts_sent.log'
+TRACKER_LOCK = RLock()
+
+# Fold the journal back into the snapshot after this many entries
+JOURNAL_COMPACT_LINES = 500
+
+# Last parsed tracker, the file state it was read at, and journal length
+_TRACKER_CACHE = {}
+_TRACKER_STAMP = None
+_JOURNAL_LINES = 0
+
+def _file_stamp():
+    """Snapshot mtime and journal size: changes whenever another process writes."""
+    try:
+        snapshot_mtime = os.stat(TRACKER_FILE).st_mtime_ns
+    except OSError:
+        snapshot_mtime = None
+    try:
+        journal_size = os.stat(TRACKER_JOURNAL).st_size
+    except OSError:
+        journal_size = 0
+    return snapshot_mtime, journal_size
+
+def _get_tracker():
+    """Return the cached tracker, re-reading the files only if they changed (read-only)."""
+    global _TRACKER_CACHE, _TRACKER_STAMP, _JOURNAL_LINES
+    with TRACKER_LOCK:
+        stamp = _file_stamp()
+        if stamp != _TRACKER_STAMP:
+            tracker = {}
+            try:
+                with open(TRACKER_FILE, 'rb') as f:
+                    tracker = orjson.loads(f.read())
+            except (OSError, ValueError):
+                pass
+            
+            # Replay the journal on top of the snapshot
+            lines = 0
+            try:
+                with open(TRACKER_JOURNAL, 'rb') as f:
+                    for line in f:
+                        try:
+                            event_key, timestamp = orjson.loads(line)
+                        except ValueError:
+                            continue  # torn last line after a crash
+                        tracker[event_key] = timestamp
+                        lines += 1
+            except OSError:
+                pass
+            
+            _TRACKER_CACHE, _TRACKER_STAMP, _JOURNAL_LINES = tracker, stamp, lines
+        return _TRACKER_CACHE
 
 def load_tracker():
     """Load sent alerts tracker."""
-    if os.path.exists(TRACKER_FILE):
-        try:
-            with open(TRACKER_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
+    # Callers mutate the result before saving: hand out a copy
+    return dict(_get_tracker())
 
 def save_tracker(tracker):
-    """Save sent alerts tracker."""
+    """Save sent alerts tracker as a new snapshot and clear the journal."""
+    global _TRACKER_CACHE, _TRACKER_STAMP, _JOURNAL_LINES
     with TRACKER_LOCK:
         try:
-            with open(TRACKER_FILE, 'w', encoding='utf-8') as f:
-                json.dump(tracker, f, ensure_ascii=False, indent=2)
+            # Write aside and swap in, so readers never see a half-written file
+            tmp_file = TRACKER_FILE + '.tmp'
+            with open(tmp_file, 'wb') as f:
+                # Compact: the snapshot is only ever read back by this module
+                f.write(orjson.dumps(tracker))
+            os.replace(tmp_file, TRACKER_FILE)
+            if os.path.exists(TRACKER_JOURNAL):
+                os.remove(TRACKER_JOURNAL)
+            _TRACKER_CACHE = tracker
+            _TRACKER_STAMP = _file_stamp()
+            _JOURNAL_LINES = 0
             return True
         except Exception as e:
             print(f"Error saving tracker: {e}")
             return False
 
+def _append_journal(event_key, timestamp):
+    """Record one sent alert in the journal and the cache."""
+    global _TRACKER_STAMP, _JOURNAL_LINES
+    with TRACKER_LOCK:
+        tracker = _get_tracker()
+        with open(TRACKER_JOURNAL, 'ab') as f:
+            f.write(orjson.dumps([event_key, timestamp]) + b'\n')
+        tracker[event_key] = timestamp
+        _TRACKER_STAMP = _file_stamp()
+        _JOURNAL_LINES += 1
+        return _JOURNAL_LINES
+
 def has_alert_been_sent_recently(user_id, city, rain_time_str, cooldown_hours=6):
     """
     Check if we've sent an alert for this user/city/rain_time recently.
@@ -44,7 +114,7 @@ def has_alert_been_sent_recently(user_id, city, rain_time_str, cooldown_hours=6)
     Returns:
         bool: True if alert was sent recently, False otherwise
     """
-    tracker = load_tracker()
+    tracker = _get_tracker()
     
     # Create a unique key for this rain event
     event_key = f"{user_id}_{city}_{rain_time_str}"
@@ -58,45 +128,49 @@ def has_alert_been_sent_recently(user_id, city, rain_time_str, cooldown_hours=6)
             # If sent within cooldown period, don't send again
             if hours_since_last < cooldown_hours:
                 return True
-        except:
+        except (TypeError, ValueError):
             # If timestamp is invalid, remove the entry
-            del tracker[event_key]
+            tracker = load_tracker()
+            tracker.pop(event_key, None)
             save_tracker(tracker)
     
     return False
 
 def mark_alert_as_sent(user_id, city, rain_time_str):
     """Mark an alert as sent for this user/city/rain_time."""
-    tracker = load_tracker()
-    
     # Create unique key
     event_key = f"{user_id}_{city}_{rain_time_str}"
     
-    # Store current time
-    tracker[event_key] = datetime.now().isoformat()
-    
-    # Clean old entries (older than 24 hours)
-    to_delete = []
-    for key, timestamp_str in tracker.items():
-        try:
-            timestamp = datetime.fromisoformat(timestamp_str)
-            if (datetime.now() - timestamp).total_seconds() > 24 * 3600:  # 24 hours
+    # Alerts are sent from several threads: append and compaction must not interleave
+    with TRACKER_LOCK:
+        # Store current time
+        if _append_journal(event_key, datetime.now().isoformat()) < JOURNAL_COMPACT_LINES:
+            return True
+        
+        # Compact: clean old entries (older than 24 hours) into a new snapshot
+        tracker = load_tracker()
+        to_delete = []
+        for key, timestamp_str in tracker.items():
+            try:
+                timestamp = datetime.fromisoformat(timestamp_str)
+                if (datetime.now() - timestamp).total_seconds() > 24 * 3600:  # 24 hours
+                    to_delete.append(key)
+            except (TypeError, ValueError):
                 to_delete.append(key)
-        except:
-            to_delete.append(key)
-    
-    for key in to_delete:
-        del tracker[key]
-    
-    save_tracker(tracker)
+        
+        for key in to_delete:
+            del tracker[key]
+        
+        save_tracker(tracker)
     return True
 
 def get_user_recent_alerts(user_id, hours=24):
     """Get recent alerts sent to a user."""
-    tracker = load_tracker()
+    tracker = _get_tracker()
     user_alerts = []
     
-    for key, timestamp_str in tracker.items():
+    # Snapshot the items: sender threads may add entries meanwhile
+    for key, timestamp_str in list(tracker.items()):
         if key.startswith(f"{user_id}_"):
             try:
                 timestamp = datetime.fromisoformat(timestamp_str)
@@ -111,7 +185,7 @@ def get_user_recent_alerts(user_id, hours=24):
                             'rain_time': rain_time,
                             'sent_at': timestamp_str
                         })
-            except:
+            except (TypeError, ValueError):
                 continue
     
     return user_alerts
\ No newline at end of file
@@ -4,20 +4,70 @@ Compatibile con le modifiche fatte alla versione locale
 """
 
 import os
+import re
 import logging
-import sqlite3
 from datetime import datetime
-from flask import Flask, request, jsonify
-import requests
+from flask import Flask, request
+from flask.json.provider import JSONProvider
+import orjson
+import telegram_client
 import pytz
-from threading import Lock
-import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from functools import partial, wraps
+import queue
+import threading
+import hmac
+import binascii
 import time
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Stats dicts can be keyed by NULL columns (e.g. a user without a language):
+# orjson rejects non-str keys unless told to stringify them
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson, so jsonify/get_json skip stdlib json."""
+    
+    # What orjson does anyway: insertion order, no whitespace
+    sort_keys = False
+    compact = True
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=ORJSON_OPTIONS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, option=ORJSON_OPTIONS), mimetype='application/json')
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+def ojson(payload, status=200):
+    """JSON response serialized with orjson (also handles datetime natively)."""
+    return app.response_class(orjson.dumps(payload, option=ORJSON_OPTIONS), status=status, mimetype='application/json')
+
+def ttl_cached(ttl):
+    """Cache a no-argument function's result for ttl seconds (for polled status endpoints)."""
+    def decorator(func):
+        cached = [0.0, None]  # expiry (monotonic), value
+        
+        @wraps(func)
+        def wrapper():
+            now = time.monotonic()
+            if now >= cached[0]:
+                # Racing threads may both refresh; either value is fine
+                cached[1] = func()
+                cached[0] = now + ttl
+            return cached[1]
+        
+        return wrapper
+    return decorator
 
 # ========== CONFIGURATION ==========
 class Config:
@@ -31,6 +81,7 @@ class Config:
     WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
     CRON_SECRET = os.getenv('CRON_SECRET', '79bed7eab2dc420069685af5cc24908a399ff47ed45c23ec1b9688311dcc81e1')
     ADMIN_USER_ID = os.getenv('ADMIN_USER_ID', '')
+    BOT_USERNAME = os.getenv('BOT_USERNAME', '').lstrip('@')
     TIMEZONE = 'Europe/Rome'
     
     @classmethod
@@ -47,207 +98,23 @@ try:
 except ValueError as e:
     logger.error(str(e))
 
-# ========== DATABASE FUNCTIONS (compatibili con bot_core.py) ==========
+# ========== USER PREFERENCES (SQLite, condivise con bot_core.py) ==========
 DB_PATH = 'users.db'
-DB_LOCK = Lock()
-
-def init_database():
-    """Initialize database tables."""
-    with DB_LOCK:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id TEXT PRIMARY KEY,
-                language TEXT DEFAULT 'en',
-                city TEXT,
-                rain_alerts INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Rain alerts log
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS rain_alerts_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT,
-                city TEXT,
-                alert_time TIMESTAMP,
-                sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
-        logger.info("✅ Database initialized")
-
-def get_user_language(user_id):
-    """Get user's preferred language."""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('SELECT language FROM users WHERE user_id = ?', (str(user_id),))
-        result = cursor.fetchone()
-        conn.close()
-        return result[0] if result else 'en'
-    except Exception as e:
-        logger.error(f"Error getting user language: {e}")
-        return 'en'
-
-def set_user_language(user_id, lang):
-    """Set user's language preference."""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Check if user exists
-        cursor.execute('SELECT 1 FROM users WHERE user_id = ?', (str(user_id),))
-        exists = cursor.fetchone()
-        
-        if exists:
-            # Update existing user
-            cursor.execute('''
-                UPDATE users 
-                SET language = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE user_id = ?
-            ''', (lang, str(user_id)))
-        else:
-            # Create new user
-            cursor.execute('''
-                INSERT INTO users (user_id, language)
-                VALUES (?, ?)
-            ''', (str(user_id), lang))
-        
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        logger.error(f"Error setting user language: {e}")
-        return False
-
-def get_user_city(user_id):
-    """Get user's saved city."""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('SELECT city FROM users WHERE user_id = ?', (str(user_id),))
-        result = cursor.fetchone()
-        conn.close()
-        return result[0] if result else None
-    except Exception as e:
-        logger.error(f"Error getting user city: {e}")
-        return None
 
-def save_user_city(user_id, city):
-    """Save user's city."""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Check if user exists
-        cursor.execute('SELECT 1 FROM users WHERE user_id = ?', (str(user_id),))
-        exists = cursor.fetchone()
-        
-        if exists:
-            # Update existing user
-            cursor.execute('''
-                UPDATE users 
-                SET city = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE user_id = ?
-            ''', (city, str(user_id)))
-        else:
-            # Create new user
-            cursor.execute('''
-                INSERT INTO users (user_id, city)
-                VALUES (?, ?)
-            ''', (str(user_id), city))
-        
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        logger.error(f"Error saving user city: {e}")
-        return False
-
-def get_rain_alerts_status(user_id):
-    """Get user's rain alerts status."""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('SELECT rain_alerts FROM users WHERE user_id = ?', (str(user_id),))
-        result = cursor.fetchone()
-        conn.close()
-        return bool(result[0]) if result else False
-    except Exception as e:
-        logger.error(f"Error getting rain alerts status: {e}")
-        return False
-
-def set_rain_alerts_status(user_id, status):
-    """Set user's rain alerts status."""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Check if user exists
-        cursor.execute('SELECT 1 FROM users WHERE user_id = ?', (str(user_id),))
-        exists = cursor.fetchone()
-        
-        if exists:
-            # Update existing user
-            cursor.execute('''
-                UPDATE users 
-                SET rain_alerts = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE user_id = ?
-            ''', (1 if status else 0, str(user_id)))
-        else:
-            # Create new user
-            cursor.execute('''
-                INSERT INTO users (user_id, rain_alerts)
-                VALUES (?, ?)
-            ''', (str(user_id), 1 if status else 0))
-        
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        logger.error(f"Error setting rain alerts status: {e}")
-        return False
-
-def get_all_users_with_cities():
-    """Get all users with saved cities."""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id, city FROM users WHERE city IS NOT NULL AND city != ""')
-        users = cursor.fetchall()
-        conn.close()
-        return {str(user[0]): user[1] for user in users}
-    except Exception as e:
-        logger.error(f"Error getting users with cities: {e}")
-        return {}
-
-def get_all_users_with_rain_alerts():
-    """Get all users with rain alerts enabled."""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id FROM users WHERE rain_alerts = 1 AND city IS NOT NULL AND city != ""')
-        users = cursor.fetchall()
-        conn.close()
-        return {str(user[0]): True for user in users}
-    except Exception as e:
-        logger.error(f"Error getting users with rain alerts: {e}")
-        return {}
+from database import db
+from user_prefs import (
+    get_user_prefs,
+    set_user_language,
+    save_user_city,
+    set_rain_alerts_status
+)
 
 # ========== WEATHER SERVICE IMPORT ==========
 try:
     from weather_service import (
         get_complete_weather_report,
-        get_detailed_rain_forecast
+        get_detailed_rain_forecast,
+        get_coordinates
     )
     logger.info("✅ Weather service imported successfully")
 except ImportError as e:
@@ -259,13 +126,39 @@ except ImportError as e:
     
     def get_detailed_rain_forecast(city, lang):
         return {'success': False, 'message': f"Rain forecast not available: {city}"}
+    
+    def get_coordinates(city_name):
+        return None, None, None
 
 # ========== CRON JOB FUNCTIONS ==========
+# Bounded pool: cron retries queue up instead of spawning one thread each
+CRON_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cron')
+
+def _log_cron_failure(future):
+    """Surface exceptions raised by a background cron job."""
+    exc = future.exception()
+    if exc:
+        logger.error(f"❌ Cron job failed: {exc}")
+
+# Cron entry points, imported at startup so the first trigger doesn't pay
+# for loading them (config.py raises without BOT_TOKEN, hence Exception)
+try:
+    from check_rain_alerts import check_and_send_rain_alerts
+    from send_morning_report import send_morning_reports
+except Exception as e:
+    logger.error(f"❌ Cannot import cron jobs: {e}")
+    _cron_import_error = e
+    
+    # Fallback functions
+    def check_and_send_rain_alerts():
+        raise RuntimeError(f"Rain alerts not available: {_cron_import_error}")
+    
+    def send_morning_reports():
+        raise RuntimeError(f"Morning reports not available: {_cron_import_error}")
+
 def run_check_rain_alerts():
     """Run rain alerts check."""
     try:
-        # Import here to avoid circular imports
-        from check_rain_alerts import check_and_send_rain_alerts
         logger.info("🌧️ Starting rain alerts check from webhook...")
         check_and_send_rain_alerts()
         return True
@@ -276,8 +169,6 @@ def run_check_rain_alerts():
 def run_send_morning_reports():
     """Send morning reports."""
     try:
-        # Import here to avoid circular imports
-        from send_morning_report import send_morning_reports
         logger.info("🌅 Starting morning reports from webhook...")
         send_morning_reports()
         return True
@@ -285,35 +176,11 @@ def run_send_morning_reports():
         logger.error(f"❌ Error in morning reports: {e}")
         return False
 
-# ========== TELEGRAM WEBHOOK HANDLER ==========
-@app.route('/webhook', methods=['POST', 'GET'])
-def webhook():
-    """Handle Telegram webhook."""
-    
-    if request.method == 'GET':
-        return "✅ Webhook endpoint active!", 200
-    
-    # Verify webhook secret
-    secret_token = request.headers.get('X-Telegram-Bot-Api-Secret-Token')
-    if Config.WEBHOOK_SECRET and secret_token != Config.WEBHOOK_SECRET:
-        logger.warning(f"Invalid webhook secret: {secret_token}")
-        return 'Unauthorized', 403
-    
-    try:
-        update = request.get_json()
-        
-        if 'message' in update:
-            chat_id = update['message']['chat']['id']
-            text = update['message'].get('text', '').strip()
-            
-            logger.info(f"Message from {chat_id}: {text}")
-            
-            lang = get_user_language(chat_id)
-            
-            # Handle commands
-            if text == '/start':
-                if lang == 'en':
-                    welcome = """Hello! I'm your Weather Bot 🌤️
+# ========== TELEGRAM COMMAND HANDLERS ==========
+# Reply texts per language; _process_update binds t = MESSAGES[lang] once
+MESSAGES = {
+    'en': {
+        'welcome': """Hello! I'm your Weather Bot 🌤️
 
 Send me a city name or use these commands:
 /weather <city> - Get full forecast (current, 24h, 5-day)
@@ -324,193 +191,8 @@ Send me a city name or use these commands:
 /myalerts - Check your rain alerts status
 /language - Change language
 
-Try sending: Rome"""
-                else:
-                    welcome = """Ciao! Sono il tuo Bot Meteo 🌤️
-
-Inviami un nome di città o usa questi comandi:
-/meteo <città> - Previsioni complete (attuali, 24h, 5 giorni)
-/pioggia <città> - Previsioni pioggia
-/salva <città> - Salva la tua città preferita
-/miometeo - Previsioni per città salvata
-/avvisipioggia - Attiva notifiche pioggia
-/mieiavvisi - Controlla i tuoi avvisi pioggia
-/lingua - Cambia lingua
-
-Prova a inviare: Roma"""
-                
-                send_message(chat_id, welcome)
-                
-            elif text in ['/language', '/lingua']:
-                keyboard = {
-                    'keyboard': [[{'text': '🇬🇧 English'}, {'text': '🇮🇹 Italiano'}]],
-                    'resize_keyboard': True,
-                    'one_time_keyboard': True
-                }
-                send_message(chat_id, "Choose language / Scegli lingua:", keyboard)
-                
-            elif text in ['🇬🇧 English', '🇮🇹 Italiano']:
-                if 'Italiano' in text:
-                    set_user_language(chat_id, 'it')
-                    send_message(chat_id, "✅ Lingua impostata su Italiano!")
-                else:
-                    set_user_language(chat_id, 'en')
-                    send_message(chat_id, "✅ Language set to English!")
-                    
-            elif text.startswith(('/weather ', '/meteo ')):
-                if ' ' in text:
-                    city = text.split(' ', 1)[1]
-                    result = get_complete_weather_report(city, lang)
-                    send_message(chat_id, result['message'])
-                    
-                    # Ask to save
-                    if result['success'] and not get_user_city(chat_id):
-                        if lang == 'en':
-                            prompt = f"\n💡 Save '{city}' as your default city? Use /save {city}"
-                        else:
-                            prompt = f"\n💡 Salvare '{city}' come tua città predefinita? Usa /salva {city}"
-                        send_message(chat_id, prompt)
-                else:
-                    if lang == 'en':
-                        send_message(chat_id, "Please specify a city. Example: /weather Rome")
-                    else:
-                        send_message(chat_id, "Specifica una città. Esempio: /meteo Roma")
-            
-            elif text.startswith(('/rain ', '/pioggia ')):
-                if ' ' in text:
-                    city = text.split(' ', 1)[1]
-                    result = get_detailed_rain_forecast(city, lang)
-                    if result['success']:
-                        send_message(chat_id, result['message'])
-                    else:
-                        if lang == 'en':
-                            send_message(chat_id, f"❌ Could not get rain data for {city}")
-                        else:
-                            send_message(chat_id, f"❌ Impossibile ottenere dati pioggia per {city}")
-                    
-                    # Ask to save
-                    if result['success'] and not get_user_city(chat_id):
-                        if lang == 'en':
-                            prompt = f"\n💡 Save '{city}' as your default city? Use /save {city}"
-                        else:
-                            prompt = f"\n💡 Salvare '{city}' come tua città predefinita? Usa /salva {city}"
-                        send_message(chat_id, prompt)
-                else:
-                    if lang == 'en':
-                        send_message(chat_id, "Please specify a city. Example: /rain Rome")
-                    else:
-                        send_message(chat_id, "Specifica una città. Esempio: /pioggia Roma")
-                    
-            elif text.startswith(('/save ', '/salva ')):
-                if ' ' in text:
-                    city = text.split(' ', 1)[1]
-                    save_user_city(chat_id, city)
-                    if lang == 'en':
-                        send_message(chat_id, f"✅ City '{city}' saved!\n\nNow use:\n/myweather - Get forecast\n/rainalerts - Enable rain alerts\n/myalerts - Check alerts status")
-                    else:
-                        send_message(chat_id, f"✅ Città '{city}' salvata!\n\nOra usa:\n/miometeo - Previsioni\n/avvisipioggia - Attiva avvisi pioggia\n/mieiavvisi - Controlla avvisi")
-                else:
-                    if lang == 'en':
-                        send_message(chat_id, "Please specify a city. Example: /save Rome")
-                    else:
-                        send_message(chat_id, "Specifica una città. Esempio: /salva Roma")
-                    
-            elif text in ['/myweather', '/miometeo']:
-                city = get_user_city(chat_id)
-                if city:
-                    result = get_complete_weather_report(city, lang)
-                    send_message(chat_id, result['message'])
-                else:
-                    if lang == 'en':
-                        send_message(chat_id, "❌ No city saved. Use /save <city> first.")
-                    else:
-                        send_message(chat_id, "❌ Nessuna città salvata. Usa prima /salva <città>.")
-                        
-            elif text in ['/myrain', '/miapioggia']:
-                city = get_user_city(chat_id)
-                if city:
-                    result = get_detailed_rain_forecast(city, lang)
-                    if result['success']:
-                        send_message(chat_id, result['message'])
-                    else:
-                        if lang == 'en':
-                            send_message(chat_id, f"❌ Could not get rain data for {city}")
-                        else:
-                            send_message(chat_id, f"❌ Impossibile ottenere dati pioggia per {city}")
-                else:
-                    if lang == 'en':
-                        send_message(chat_id, "❌ No city saved. Use /save <city> first.")
-                    else:
-                        send_message(chat_id, "❌ Nessuna città salvata. Usa prima /salva <città>.")
-            
-            elif text in ['/rainalerts', '/avvisipioggia']:
-                saved_city = get_user_city(chat_id)
-                if not saved_city:
-                    if lang == 'en':
-                        send_message(chat_id, "❌ No city saved. Use /save <city> first.")
-                    else:
-                        send_message(chat_id, "❌ Nessuna città salvata. Usa prima /salva <città>.")
-                    return
-                
-                current = get_rain_alerts_status(chat_id)
-                new_status = not current
-                set_rain_alerts_status(chat_id, new_status)
-                
-                if new_status:
-                    if lang == 'en':
-                        message = f"✅ Rain alerts ACTIVATED for {saved_city}!\n\n"
-                        message += "You'll receive alerts when rain is expected.\n"
-                        message += "• Active: 24/7\n"
-                        message += "• Cooldown: 6 hours between alerts\n"
-                        message += "• Data: Saved in database ✅\n\n"
-                        message += "Use /myalerts to check status"
-                    else:
-                        message = f"✅ Avvisi pioggia ATTIVATI per {saved_city}!\n\n"
-                        message += "Riceverai avvisi quando è prevista pioggia.\n"
-                        message += "• Attivi: 24/7\n"
-                        message += "• Pausa: 6 ore tra gli avvisi\n"
-                        message += "• Dati: Salvati su database ✅\n\n"
-                        message += "Usa /mieiavvisi per controllare lo stato"
-                else:
-                    if lang == 'en':
-                        message = "❌ Rain alerts DEACTIVATED."
-                    else:
-                        message = "❌ Avvisi pioggia DISATTIVATI."
-                
-                send_message(chat_id, message)
-            
-            elif text in ['/myalerts', '/mieiavvisi']:
-                alerts_enabled = get_rain_alerts_status(chat_id)
-                city = get_user_city(chat_id)
-                
-                if lang == 'en':
-                    message = "🔔 *Your Rain Alerts Status*\n\n"
-                    if alerts_enabled and city:
-                        message += f"✅ **ACTIVE** for {city}\n"
-                        message += "You'll receive alerts when rain is expected.\n\n"
-                    elif city:
-                        message += f"❌ **INACTIVE** for {city}\n\n"
-                        message += "Enable alerts with /rainalerts"
-                    else:
-                        message += "❌ No city saved\n\n"
-                        message += "Save a city first with /save <city>"
-                else:
-                    message = "🔔 *Stato Avvisi Pioggia*\n\n"
-                    if alerts_enabled and city:
-                        message += f"✅ **ATTIVI** per {city}\n"
-                        message += "Riceverai avvisi quando è prevista pioggia.\n\n"
-                    elif city:
-                        message += f"❌ **DISATTIVI** per {city}\n\n"
-                        message += "Attiva gli avvisi con /avvisipioggia"
-                    else:
-                        message += "❌ Nessuna città salvata\n\n"
-                        message += "Salva prima una città con /salva <città>"
-                
-                send_message(chat_id, message)
-            
-            elif text in ['/help', '/aiuto']:
-                if lang == 'en':
-                    help_text = """🌤️ **Weather Bot Help**
+Try sending: Rome""",
+        'help': """🌤️ **Weather Bot Help**
 
 **Commands:**
 /weather <city> - Get full forecast (current, 24h, 5-day)
@@ -526,9 +208,43 @@ Prova a inviare: Roma"""
 • Data is saved in database (won't be lost!)
 • Rain alerts have 6-hour cooldown
 • Alerts are active 24/7
-• Just send a city name for quick forecast!"""
-                else:
-                    help_text = """🌤️ **Aiuto Bot Meteo**
+• Just send a city name for quick forecast!""",
+        'rain_error': "❌ Could not get rain data for {city}",
+        'save_prompt': "\n💡 Save '{city}' as your default city? Use /save {city}",
+        'weather_usage': "Please specify a city. Example: /weather Rome",
+        'rain_usage': "Please specify a city. Example: /rain Rome",
+        'save_usage': "Please specify a city. Example: /save Rome",
+        'city_saved': "✅ City '{city}' saved!\n\nNow use:\n/myweather - Get forecast\n/rainalerts - Enable rain alerts\n/myalerts - Check alerts status",
+        'no_city': "❌ No city saved. Use /save <city> first.",
+        'alerts_on': (
+            "✅ Rain alerts ACTIVATED for {city}!\n\n"
+            "You'll receive alerts when rain is expected.\n"
+            "• Active: 24/7\n"
+            "• Cooldown: 6 hours between alerts\n"
+            "• Data: Saved in database ✅\n\n"
+            "Use /myalerts to check status"
+        ),
+        'alerts_off': "❌ Rain alerts DEACTIVATED.",
+        'status_active': "🔔 *Your Rain Alerts Status*\n\n✅ **ACTIVE** for {city}\nYou'll receive alerts when rain is expected.\n\n",
+        'status_inactive': "🔔 *Your Rain Alerts Status*\n\n❌ **INACTIVE** for {city}\n\nEnable alerts with /rainalerts",
+        'status_no_city': "🔔 *Your Rain Alerts Status*\n\n❌ No city saved\n\nSave a city first with /save <city>",
+        'send_city': "Send me a city name (e.g. 'Rome') or use /help",
+        'lang_set': "✅ Language set to English!",
+    },
+    'it': {
+        'welcome': """Ciao! Sono il tuo Bot Meteo 🌤️
+
+Inviami un nome di città o usa questi comandi:
+/meteo <città> - Previsioni complete (attuali, 24h, 5 giorni)
+/pioggia <città> - Previsioni pioggia
+/salva <città> - Salva la tua città preferita
+/miometeo - Previsioni per città salvata
+/avvisipioggia - Attiva notifiche pioggia
+/mieiavvisi - Controlla i tuoi avvisi pioggia
+/lingua - Cambia lingua
+
+Prova a inviare: Roma""",
+        'help': """🌤️ **Aiuto Bot Meteo**
 
 **Comandi:**
 /meteo <città> - Previsioni complete (attuali, 24h, 5 giorni)
@@ -544,265 +260,536 @@ Prova a inviare: Roma"""
 • I dati sono salvati su database (non si perdono!)
 • Avvisi pioggia hanno pausa di 6 ore
 • Avvisi attivi 24/7
-• Invia solo un nome di città per previsioni rapide!"""
-                send_message(chat_id, help_text)
-                
-            else:
-                # Assume it's a city name (not a command)
-                if text and len(text) < 50 and not text.startswith('/'):
-                    result = get_complete_weather_report(text, lang)
-                    send_message(chat_id, result['message'])
-                    
-                    if result['success'] and not get_user_city(chat_id):
-                        if lang == 'en':
-                            prompt = f"\n💡 Save '{text}' as your city? Use /save {text}"
-                        else:
-                            prompt = f"\n💡 Salvare '{text}' come tua città? Usa /salva {text}"
-                        send_message(chat_id, prompt)
-                elif text:
-                    if lang == 'en':
-                        send_message(chat_id, "Send me a city name (e.g. 'Rome') or use /help")
-                    else:
-                        send_message(chat_id, "Inviami un nome di città (es. 'Roma') o usa /aiuto")
-        
+• Invia solo un nome di città per previsioni rapide!""",
+        'rain_error': "❌ Impossibile ottenere dati pioggia per {city}",
+        'save_prompt': "\n💡 Salvare '{city}' come tua città predefinita? Usa /salva {city}",
+        'weather_usage': "Specifica una città. Esempio: /meteo Roma",
+        'rain_usage': "Specifica una città. Esempio: /pioggia Roma",
+        'save_usage': "Specifica una città. Esempio: /salva Roma",
+        'city_saved': "✅ Città '{city}' salvata!\n\nOra usa:\n/miometeo - Previsioni\n/avvisipioggia - Attiva avvisi pioggia\n/mieiavvisi - Controlla avvisi",
+        'no_city': "❌ Nessuna città salvata. Usa prima /salva <città>.",
+        'alerts_on': (
+            "✅ Avvisi pioggia ATTIVATI per {city}!\n\n"
+            "Riceverai avvisi quando è prevista pioggia.\n"
+            "• Attivi: 24/7\n"
+            "• Pausa: 6 ore tra gli avvisi\n"
+            "• Dati: Salvati su database ✅\n\n"
+            "Usa /mieiavvisi per controllare lo stato"
+        ),
+        'alerts_off': "❌ Avvisi pioggia DISATTIVATI.",
+        'status_active': "🔔 *Stato Avvisi Pioggia*\n\n✅ **ATTIVI** per {city}\nRiceverai avvisi quando è prevista pioggia.\n\n",
+        'status_inactive': "🔔 *Stato Avvisi Pioggia*\n\n❌ **DISATTIVI** per {city}\n\nAttiva gli avvisi con /avvisipioggia",
+        'status_no_city': "🔔 *Stato Avvisi Pioggia*\n\n❌ Nessuna città salvata\n\nSalva prima una città con /salva <città>",
+        'send_city': "Inviami un nome di città (es. 'Roma') o usa /aiuto",
+        'lang_set': "✅ Lingua impostata su Italiano!",
+    },
+}
+
+def _handle_start(chat_id, arg, lang, t, prefs):
+    """Send the welcome message."""
+    send_message(chat_id, t['welcome'])
+
+# Built once and shared by every /language reply
+_LANG_KEYBOARD = {
+    'keyboard': [[{'text': '🇬🇧 English'}, {'text': '🇮🇹 Italiano'}]],
+    'resize_keyboard': True,
+    'one_time_keyboard': True
+}
+
+def _handle_lang(chat_id, arg, lang, t, prefs):
+    """Show the language chooser keyboard."""
+    send_message(chat_id, "Choose language / Scegli lingua:", _LANG_KEYBOARD)
+
+def _handle_set_lang(chat_id, arg, lang, t, prefs, new_lang):
+    """Save the language picked from the keyboard and confirm in that language."""
+    set_user_language(chat_id, new_lang)
+    send_message(chat_id, MESSAGES[new_lang]['lang_set'])
+
+def _fetch_and_format(city, lang, t, fetcher):
+    """Run a forecast fetcher for city and return (message, success)."""
+    result = fetcher(city, lang)
+    # Full reports carry their own error text, rain forecasts don't
+    if result['success'] or fetcher is not get_detailed_rain_forecast:
+        return result['message'], result['success']
+    
+    return t['rain_error'].format(city=city), False
+
+def _send_forecast(chat_id, city, lang, t, fetcher, offer_save):
+    """Send a forecast, then offer to save the city if offer_save is set."""
+    response_text, ok = _fetch_and_format(city, lang, t, fetcher)
+    # Error texts are plain but echo the city, which may contain '_' or '*'
+    send_message(chat_id, response_text, markdown=None if ok else False)
+    
+    if ok and offer_save:
+        send_message(chat_id, t['save_prompt'].format(city=city), markdown=False)
+
+def _handle_weather(chat_id, arg, lang, t, prefs):
+    """Send the full forecast for the given city."""
+    if arg:
+        _send_forecast(chat_id, arg, lang, t, get_complete_weather_report, not prefs['city'])
+    else:
+        send_message(chat_id, t['weather_usage'])
+
+def _handle_rain(chat_id, arg, lang, t, prefs):
+    """Send the detailed rain forecast for the given city."""
+    if arg:
+        _send_forecast(chat_id, arg, lang, t, get_detailed_rain_forecast, not prefs['city'])
+    else:
+        send_message(chat_id, t['rain_usage'])
+
+def _handle_save(chat_id, arg, lang, t, prefs):
+    """Save the given city as the user's default."""
+    if arg:
+        save_user_city(chat_id, arg)
+        send_message(chat_id, t['city_saved'].format(city=arg), markdown=False)
+    else:
+        send_message(chat_id, t['save_usage'])
+
+def _handle_mine(chat_id, arg, lang, t, prefs):
+    """Send the full forecast for the saved city."""
+    city = prefs['city']
+    if city:
+        _send_forecast(chat_id, city, lang, t, get_complete_weather_report, False)
+    else:
+        send_message(chat_id, t['no_city'])
+
+def _handle_myrain(chat_id, arg, lang, t, prefs):
+    """Send the detailed rain forecast for the saved city."""
+    city = prefs['city']
+    if city:
+        _send_forecast(chat_id, city, lang, t, get_detailed_rain_forecast, False)
+    else:
+        send_message(chat_id, t['no_city'])
+
+def _handle_alerts(chat_id, arg, lang, t, prefs):
+    """Toggle rain alerts for the saved city."""
+    saved_city = prefs['city']
+    if not saved_city:
+        send_message(chat_id, t['no_city'])
+        return
+    
+    new_status = not prefs['rain_alerts']
+    set_rain_alerts_status(chat_id, new_status)
+    
+    if new_status:
+        message = t['alerts_on'].format(city=saved_city)
+    else:
+        message = t['alerts_off']
+    
+    # Plain text around the user's city name
+    send_message(chat_id, message, markdown=False)
+
+def _handle_myalerts(chat_id, arg, lang, t, prefs):
+    """Show the user's rain alerts status."""
+    alerts_enabled = prefs['rain_alerts']
+    city = prefs['city']
+    
+    # Each status text starts with the title: one format, no concatenation
+    if alerts_enabled and city:
+        message = t['status_active'].format(city=city)
+    elif city:
+        message = t['status_inactive'].format(city=city)
+    else:
+        message = t['status_no_city']
+    
+    send_message(chat_id, message)
+
+def _handle_help(chat_id, arg, lang, t, prefs):
+    """Send the help message."""
+    send_message(chat_id, t['help'])
+
+# Plausible city names: start with a letter, then letters, digits, spaces
+# and ' . , ( ) - up to 49 chars. Rejects emoji, URLs, commands, paragraphs.
+_CITY_RE = re.compile(r"[^\W\d_][\w '’.,()\-]{1,48}")
+
+# Chatter that passes the pattern but is never a city
+_NOT_CITIES = frozenset({
+    'hi', 'hello', 'hey', 'thanks', 'thank you', 'ok', 'okay', 'yes', 'no',
+    'ciao', 'grazie', 'salve', 'buongiorno', 'buonasera', 'si', 'sì',
+})
+
+def _handle_city(chat_id, text, lang, t, prefs):
+    """Treat free text as a city name (not a command)."""
+    # text is already stripped by _process_update
+    if _CITY_RE.fullmatch(text) and text.lower() not in _NOT_CITIES:
+        _send_forecast(chat_id, text, lang, t, get_complete_weather_report, not prefs['city'])
+    else:
+        send_message(chat_id, t['send_city'])
+
+# Command table: first token of the message -> handler(chat_id, arg, lang, t, prefs)
+COMMANDS = {
+    '/start': _handle_start,
+    '/help': _handle_help,
+    '/aiuto': _handle_help,
+    '/language': _handle_lang,
+    '/lingua': _handle_lang,
+    '/weather': _handle_weather,
+    '/meteo': _handle_weather,
+    '/rain': _handle_rain,
+    '/pioggia': _handle_rain,
+    '/save': _handle_save,
+    '/salva': _handle_save,
+    '/savecity': _handle_save,
+    '/salvacitta': _handle_save,
+    '/myweather': _handle_mine,
+    '/miometeo': _handle_mine,
+    '/myrain': _handle_myrain,
+    '/miapioggia': _handle_myrain,
+    '/rainalerts': _handle_alerts,
+    '/avvisipioggia': _handle_alerts,
+    '/myalerts': _handle_myalerts,
+    '/mieiavvisi': _handle_myalerts,
+}
+
+# In group chats commands arrive as /weather@BotName: add those keys once here
+if Config.BOT_USERNAME:
+    COMMANDS.update({
+        f'{cmd}@{Config.BOT_USERNAME}': handler
+        for cmd, handler in list(COMMANDS.items())
+    })
+
+# Whole-message matches (keyboard buttons), looked up before COMMANDS
+BUTTONS = {
+    '🇬🇧 English': partial(_handle_set_lang, new_lang='en'),
+    '🇮🇹 Italiano': partial(_handle_set_lang, new_lang='it'),
+}
+
+def _process_update(update):
+    """Route a Telegram message update to the matching command handler."""
+    chat_id = update['message']['chat']['id']
+    text = update['message'].get('text', '').strip()
+    
+    # Stickers, photos, joins... nothing to answer, skip the prefs lookup
+    if not text:
+        return
+    
+    logger.info(f"Message from {chat_id}: {text}")
+    
+    # One row lookup; handlers read the city and alerts status from prefs
+    prefs = get_user_prefs(chat_id)
+    lang = prefs['language']
+    t = MESSAGES.get(lang, MESSAGES['en'])
+    
+    handler = BUTTONS.get(text)
+    if handler:
+        handler(chat_id, '', lang, t, prefs)
+        return
+    
+    # Every COMMANDS key starts with '/': plain text skips the split and lookup
+    if text[0] == '/':
+        # text is already stripped: one split yields the command and a clean
+        # argument, whatever whitespace (spaces, newline) separates them
+        cmd, *rest = text.split(None, 1)
+        handler = COMMANDS.get(cmd)
+        if handler:
+            handler(chat_id, rest[0] if rest else '', lang, t, prefs)
+            return
+    
+    # Assume it's a city name (not a command)
+    _handle_city(chat_id, text, lang, t, prefs)
+
+# ========== UPDATE WORKERS ==========
+# The webhook only enqueues; weather lookups and replies run here, so
+# Telegram gets its 200 at once and never retries a slow update
+UPDATE_QUEUE_SIZE = 1000
+# Replies block on Open-Meteo and Telegram I/O, not CPU: raise this (no code
+# change needed) if the queue backs up under bursts
+UPDATE_WORKERS = max(1, int(os.environ.get('UPDATE_WORKERS', 8)))
+# One queue per worker, picked by chat id: a chat's updates run in order
+# ("/save X" then "/myweather"), different chats still run in parallel.
+# UPDATE_QUEUE_SIZE is split between them, so load is shed per queue: a
+# burst fills its own queue and drops only updates for chats hashed to it.
+UPDATE_QUEUES = [
+    queue.Queue(maxsize=max(1, UPDATE_QUEUE_SIZE // UPDATE_WORKERS))
+    for _ in range(UPDATE_WORKERS)
+]
+# Actual total: the split rounds down, and each queue holds at least one
+UPDATE_CAPACITY = sum(q.maxsize for q in UPDATE_QUEUES)
+# Incremented from gunicorn's request threads
+dropped_updates = 0
+_dropped_lock = threading.Lock()
+
+def _queue_for(update):
+    """Queue of the worker that owns this update's chat."""
+    chat_id = update['message']['chat']['id']
+    return UPDATE_QUEUES[hash(chat_id) % UPDATE_WORKERS]
+
+def _update_worker(updates):
+    """Process one worker's queued updates forever."""
+    while True:
+        update = updates.get()
+        try:
+            _process_update(update)
+        except Exception as e:
+            logger.error(f"Error processing update: {e}")
+        finally:
+            updates.task_done()
+
+for _i, _updates in enumerate(UPDATE_QUEUES):
+    threading.Thread(target=_update_worker, args=(_updates,), name=f'update-{_i}', daemon=True).start()
+
+# ========== TELEGRAM WEBHOOK HANDLER ==========
+_WEBHOOK_SECRET_BYTES = Config.WEBHOOK_SECRET.encode() if Config.WEBHOOK_SECRET else None
+
+# Recently accepted update_ids: Telegram re-delivers updates it thinks failed
+SEEN_UPDATES_SIZE = 10000
+_SEEN_UPDATES = OrderedDict()
+_SEEN_LOCK = threading.Lock()
+
+def _is_duplicate_update(update_id):
+    """Record update_id; True if it was already seen recently."""
+    if update_id is None:
+        return False
+    with _SEEN_LOCK:
+        if update_id in _SEEN_UPDATES:
+            return True
+        _SEEN_UPDATES[update_id] = None
+        if len(_SEEN_UPDATES) > SEEN_UPDATES_SIZE:
+            _SEEN_UPDATES.popitem(last=False)
+        return False
+
+@app.route('/webhook', methods=['POST', 'GET'])
+def webhook():
+    """Handle Telegram webhook."""
+    global dropped_updates
+    
+    if request.method == 'GET':
+        return "✅ Webhook endpoint active!", 200
+    
+    # Verify webhook secret (constant-time, on bytes so non-ASCII headers can't raise)
+    secret_token = request.headers.get('X-Telegram-Bot-Api-Secret-Token')
+    if _WEBHOOK_SECRET_BYTES and not (
+        secret_token and hmac.compare_digest(secret_token.encode(), _WEBHOOK_SECRET_BYTES)
+    ):
+        logger.warning(f"Invalid webhook secret: {secret_token}")
+        return 'Unauthorized', 403
+    
+    try:
+        # Telegram always posts JSON: parse the raw body with orjson and
+        # don't keep it cached on the request
+        try:
+            update = orjson.loads(request.get_data(cache=False))
+        except orjson.JSONDecodeError:
+            update = None
+        # Ack update types we don't handle (edited_message, my_chat_member, ...)
+        if not update or 'message' not in update:
+            return 'OK', 200
+        
+        if _is_duplicate_update(update.get('update_id')):
+            logger.info(f"Skipping duplicate update {update['update_id']}")
+            return 'OK', 200
+        
+        try:
+            _queue_for(update).put_nowait(update)
+        except queue.Full:
+            # Shed load rather than stall the webhook
+            with _dropped_lock:
+                dropped_updates += 1
+                dropped = dropped_updates
+            logger.warning(f"⚠️ Worker queue for chat {update['message']['chat']['id']} full, "
+                           f"dropped update ({dropped} so far; other workers' queues unaffected)")
         return 'OK', 200
         
     except Exception as e:
         logger.error(f"Error in webhook: {e}")
         return 'OK', 200
 
-def send_message(chat_id, text, reply_markup=None):
-    """Send message to Telegram."""
-    try:
-        url = f"https://api.telegram.org/bot{Config.BOT_TOKEN}/sendMessage"
-        data = {
-            'chat_id': chat_id,
-            'text': text,
-            'parse_mode': 'Markdown'
-        }
-        if reply_markup:
-            data['reply_markup'] = reply_markup
-        
-        response = requests.post(url, json=data, timeout=10)
-        return response.json()
-    except Exception as e:
-        logger.error(f"Failed to send message: {e}")
-        return None
+def send_message(chat_id, text, reply_markup=None, markdown=None):
+    """Send message to Telegram (markdown=None auto-detects formatting)."""
+    return telegram_client.send_message(Config.BOT_TOKEN, chat_id, text, reply_markup, markdown)
 
 # ========== CRON JOB ENDPOINTS ==========
+# Encode the key once; each request is a single C-level hmac.digest call
+_CRON_KEY_BYTES = Config.CRON_SECRET.encode() if Config.CRON_SECRET else None
+
 def verify_cron_signature(request):
-    """Verify cron job signature."""
+    """Verify cron job signature (HMAC-SHA256 of the request body)."""
     received_signature = request.headers.get('X-Cron-Signature')
-    if not received_signature:
+    if not received_signature or _CRON_KEY_BYTES is None:
         return False
     
-    # Il segreto è hardcoded come richiesto
-    expected_signature = "79bed7eab2dc420069685af5cc24908a399ff47ed45c23ec1b9688311dcc81e1"
+    received = received_signature.encode()
+    # hexlify goes straight to bytes, no intermediate str
+    expected_signature = binascii.hexlify(hmac.digest(_CRON_KEY_BYTES, request.get_data(), 'sha256'))
+    
+    if hmac.compare_digest(received, expected_signature):
+        return True
     
-    # Compare directly since we're using hardcoded secret
-    return received_signature == expected_signature
+    # Cron jobs configured before signing was enforced send the raw secret
+    return hmac.compare_digest(received, _CRON_KEY_BYTES)
 
 @app.route('/trigger-rain-check', methods=['POST'])
 def trigger_rain_check():
     """Endpoint for rain alerts cron job."""
     if not verify_cron_signature(request):
-        return jsonify({'error': 'Unauthorized'}), 403
+        return ojson({'error': 'Unauthorized'}, 403)
     
     logger.info("🌧️ Triggering rain check via cron job")
     
     try:
-        # Run rain check synchronously
-        success = run_check_rain_alerts()
-        if success:
-            return jsonify({'status': 'success', 'message': 'Rain check completed'}), 200
-        else:
-            return jsonify({'status': 'error', 'message': 'Rain check failed'}), 500
+        future = CRON_POOL.submit(run_check_rain_alerts)
+        future.add_done_callback(_log_cron_failure)
+        return ojson({'status': 'accepted', 'message': 'Rain check started'}, 202)
     except Exception as e:
         logger.error(f"Error in rain check: {e}")
-        return jsonify({'status': 'error', 'message': str(e)}), 500
+        return ojson({'status': 'error', 'message': str(e)}, 500)
 
 @app.route('/trigger-morning-reports', methods=['POST'])
 def trigger_morning_reports():
     """Endpoint for morning reports cron job."""
     if not verify_cron_signature(request):
-        return jsonify({'error': 'Unauthorized'}), 403
+        return ojson({'error': 'Unauthorized'}, 403)
     
     logger.info("🌅 Triggering morning reports via cron job")
     
     try:
-        # Run morning reports synchronously
-        success = run_send_morning_reports()
-        if success:
-            return jsonify({'status': 'success', 'message': 'Morning reports sent'}), 200
-        else:
-            return jsonify({'status': 'error', 'message': 'Morning reports failed'}), 500
+        future = CRON_POOL.submit(run_send_morning_reports)
+        future.add_done_callback(_log_cron_failure)
+        return ojson({'status': 'accepted', 'message': 'Morning reports started'}, 202)
     except Exception as e:
         logger.error(f"Error in morning reports: {e}")
-        return jsonify({'status': 'error', 'message': str(e)}), 500
+        return ojson({'status': 'error', 'message': str(e)}, 500)
 
 # ========== DEBUG & DIAGNOSTICS ENDPOINTS ==========
+def _json_errors(view):
+    """Turn an exception in a debug view into a logged 500 JSON error."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            return view(*args, **kwargs)
+        except Exception as e:
+            logger.exception(f"❌ {view.__name__} failed")
+            return ojson({'error': str(e)}, 500)
+    return wrapper
+
+# Uptime monitors poll the status endpoints: recompute at most this often
+STATS_CACHE_TTL = 30
+
+@ttl_cached(STATS_CACHE_TTL)
+def _database_stats_body():
+    """Serialized /debug/database-stats body.
+    
+    Cached as bytes: the row dicts are dropped right after serializing and
+    every hit within the TTL sends the same buffer.
+    """
+    # Pooled read-only connection (see database.UserDatabase)
+    stats = db.get_usage_stats()
+    
+    return orjson.dumps({
+        'database': {
+            'total_users': stats['total_users'],
+            'users_with_saved_cities': stats['users_with_cities'],
+            'users_with_rain_alerts': stats['users_with_rain_alerts'],
+            'total_rain_alerts_sent': stats['total_rain_alerts_sent'],
+            'recently_active_users': stats['recently_active_users']
+        },
+        'city_distribution': [{'city': city, 'users': count} for city, count in stats['city_distribution']],
+        'languages': dict(stats['languages']),
+        'privacy_note': 'No personal user data exposed'
+    }, option=ORJSON_OPTIONS)
+
 @app.route('/debug/database-stats', methods=['GET'])
+@_json_errors
 def debug_database_stats():
     """Debug endpoint to check database statistics (no personal data)."""
-    try:
-        # Get stats
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT COUNT(*) FROM users')
-        total_users = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM users WHERE city IS NOT NULL AND city != ""')
-        users_with_cities = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM users WHERE rain_alerts = 1')
-        users_with_alerts = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM rain_alerts_log')
-        total_alerts = cursor.fetchone()[0]
-        
-        # Get city distribution (anonymized)
-        cursor.execute('''
-            SELECT city, COUNT(*) as user_count 
-            FROM users 
-            WHERE city IS NOT NULL AND city != ""
-            GROUP BY city 
-            ORDER BY user_count DESC
-        ''')
-        city_distribution = cursor.fetchall()
-        
-        # Get languages distribution
-        cursor.execute('SELECT language, COUNT(*) FROM users GROUP BY language')
-        language_distribution = cursor.fetchall()
-        
-        # Get recent activity (anonymized)
-        cursor.execute('''
-            SELECT COUNT(*) as recent_users 
-            FROM users 
-            WHERE datetime(updated_at) > datetime('now', '-1 day')
-        ''')
-        recent_users = cursor.fetchone()[0]
-        
-        conn.close()
-        
-        return jsonify({
-            'database': {
-                'total_users': total_users,
-                'users_with_saved_cities': users_with_cities,
-                'users_with_rain_alerts': users_with_alerts,
-                'total_rain_alerts_sent': total_alerts,
-                'recently_active_users': recent_users
-            },
-            'city_distribution': [
-                {'city': city, 'users': count} 
-                for city, count in city_distribution
-            ],
-            'languages': {
-                lang: count for lang, count in language_distribution
-            },
-            'privacy_note': 'No personal user data exposed'
-        })
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return app.response_class(_database_stats_body(), mimetype='application/json')
 
 @app.route('/debug/weather-test/<city>', methods=['GET'])
+@_json_errors
 def debug_weather_test(city):
     """Test weather service for any city."""
+    result = get_complete_weather_report(city, 'en')
+    
+    return ojson({
+        'city': city,
+        'weather_service_ok': result['success'],
+        'message_preview': result['message'][:200] if result['success'] else result['message'],
+        'note': 'Test weather data only'
+    })
+
+# Shorter than the stats TTL: the queue figures should stay fairly live
+HEALTH_CACHE_TTL = 15
+
+@ttl_cached(HEALTH_CACHE_TTL)
+def _system_health_body():
+    """Serialized /debug/system-health body, rebuilt at most once per HEALTH_CACHE_TTL."""
+    # Database health (pooled read-only connection)
+    stats = db.get_stats()
+    
+    # One stat() for both existence and size
     try:
-        from weather_service import get_complete_weather_report
-        
-        result = get_complete_weather_report(city, 'en')
-        
-        return jsonify({
-            'city': city,
-            'weather_service_ok': result['success'],
-            'message_preview': result['message'][:200] if result['success'] else result['message'],
-            'note': 'Test weather data only'
-        })
-            
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        db_size = os.stat(DB_PATH).st_size
+        db_exists = True
+    except FileNotFoundError:
+        db_size, db_exists = 0, False
+    
+    # Weather service health
+    lat, lon, region = get_coordinates("Rome")
+    weather_service_ok = lat is not None
+    
+    # Current time
+    rome_tz = pytz.timezone('Europe/Rome')
+    current_time = datetime.now(rome_tz)
+    
+    return orjson.dumps({
+        'status': 'healthy',
+        'timestamp': current_time,
+        'timezone': 'Europe/Rome',
+        'current_time': current_time.strftime('%H:%M %d/%m/%Y'),
+        
+        'database': {
+            'exists': db_exists,
+            'size_bytes': db_size,
+            'total_users': stats['total_users'],
+            'users_with_cities': stats['users_with_cities'],
+            'users_with_rain_alerts': stats['users_with_rain_alerts']
+        },
+        
+        'services': {
+            'weather_api': weather_service_ok,
+            'telegram_bot': bool(Config.BOT_TOKEN),
+            'webhook_active': Config.IS_RENDER
+        },
+        
+        'update_queue': {
+            'workers': UPDATE_WORKERS,
+            'pending': sum(q.qsize() for q in UPDATE_QUEUES),
+            'capacity': UPDATE_CAPACITY,
+            'dropped': dropped_updates
+        },
+        
+        'cron_jobs': {
+            'rain_alerts': {
+                'endpoint': '/trigger-rain-check',
+                'method': 'POST',
+                'frequency': 'every 30 minutes',
+                'active': True
+            },
+            'morning_reports': {
+                'endpoint': '/trigger-morning-reports',
+                'method': 'POST',
+                'frequency': 'daily at 8:00 AM',
+                'active': True
+            }
+        },
+        
+        'features': {
+            'rain_alerts_24_7': True,
+            'morning_reports': True,
+            'multi_language': True,
+            'persistent_database': True,
+            'complete_weather_format': True
+        }
+    }, option=ORJSON_OPTIONS)
 
 @app.route('/debug/system-health', methods=['GET'])
+@_json_errors
 def system_health():
     """Comprehensive system health check."""
-    try:
-        # Database health
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT COUNT(*) FROM users')
-        total_users = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM users WHERE city IS NOT NULL AND city != ""')
-        users_with_cities = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM users WHERE rain_alerts = 1')
-        users_with_alerts = cursor.fetchone()[0]
-        
-        conn.close()
-        
-        db_size = os.path.getsize(DB_PATH) if os.path.exists(DB_PATH) else 0
-        
-        # Weather service health
-        from weather_service import get_coordinates
-        lat, lon, region = get_coordinates("Rome")
-        weather_service_ok = lat is not None
-        
-        # Current time
-        rome_tz = pytz.timezone('Europe/Rome')
-        current_time = datetime.now(rome_tz)
-        
-        return jsonify({
-            'status': 'healthy',
-            'timestamp': current_time.isoformat(),
-            'timezone': 'Europe/Rome',
-            'current_time': current_time.strftime('%H:%M %d/%m/%Y'),
-            
-            'database': {
-                'exists': os.path.exists(DB_PATH),
-                'size_bytes': db_size,
-                'total_users': total_users,
-                'users_with_cities': users_with_cities,
-                'users_with_rain_alerts': users_with_alerts
-            },
-            
-            'services': {
-                'weather_api': weather_service_ok,
-                'telegram_bot': bool(Config.BOT_TOKEN),
-                'webhook_active': Config.IS_RENDER
-            },
-            
-            'cron_jobs': {
-                'rain_alerts': {
-                    'endpoint': '/trigger-rain-check',
-                    'method': 'POST',
-                    'frequency': 'every 30 minutes',
-                    'active': True
-                },
-                'morning_reports': {
-                    'endpoint': '/trigger-morning-reports',
-                    'method': 'POST',
-                    'frequency': 'daily at 8:00 AM',
-                    'active': True
-                }
-            },
-            
-            'features': {
-                'rain_alerts_24_7': True,
-                'morning_reports': True,
-                'multi_language': True,
-                'persistent_database': True,
-                'complete_weather_format': True
-            }
-        })
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return app.response_class(_system_health_body(), mimetype='application/json')
 
 # ========== HEALTH ENDPOINTS ==========
-@app.route('/')
-def home():
-    return """
+_HOME_HTML = """
     <html>
     <head>
         <title>🌤️ Weather Bot</title>
@@ -822,7 +809,7 @@ def home():
             
             <div class="endpoint">
                 <h3>📊 Bot Status</h3>
-                <p><strong>Health Check:</strong> <a href="/health">/health</a></p>
+                <p><strong>Health Check:</strong> <a href="/health">/health</a> (liveness), <a href="/health/ready">/health/ready</a> (readiness)</p>
                 <p><strong>Database Stats:</strong> <a href="/debug/database-stats">/debug/database-stats</a></p>
                 <p><strong>System Health:</strong> <a href="/debug/system-health">/debug/system-health</a></p>
                 <p><strong>Ping:</strong> <a href="/ping">/ping</a></p>
@@ -845,71 +832,99 @@ def home():
     </html>
     """
 
+# Static bodies are encoded and wrapped once; the routes hand back the same object
+_HOME_RESPONSE = app.response_class(
+    response=_HOME_HTML.encode('utf-8'),
+    status=200,
+    mimetype='text/html',
+    headers={'Cache-Control': 'public, max-age=300'},
+    direct_passthrough=True
+)
+_HEALTH_RESPONSE = app.response_class(
+    response=b'{"status":"healthy","service":"telegram-weather-bot","webhook_endpoint":"/webhook"}',
+    status=200,
+    mimetype='application/json',
+    direct_passthrough=True
+)
+_READY_RESPONSE = app.response_class(
+    response=b'{"status":"ready"}',
+    status=200,
+    mimetype='application/json',
+    direct_passthrough=True
+)
+
+@app.route('/')
+def home():
+    return _HOME_RESPONSE
+
+# Liveness: the process answers. Static, never touches the database, so
+# the platform's frequent probe stays cheap
 @app.route('/health')
+@app.route('/health/live')
 def health():
+    return _HEALTH_RESPONSE
+
+# Readiness: the database answers and there is room to queue updates
+@app.route('/health/ready')
+def health_ready():
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT COUNT(*) FROM users')
-        total_users = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM users WHERE city IS NOT NULL AND city != ""')
-        users_with_cities = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM users WHERE rain_alerts = 1')
-        users_with_alerts = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM rain_alerts_log')
-        total_alerts = cursor.fetchone()[0]
-        
-        conn.close()
-        
-        return jsonify({
-            'status': 'healthy',
-            'service': 'telegram-weather-bot',
-            'timestamp': datetime.now().isoformat(),
-            'database': {
-                'total_users': total_users,
-                'users_with_cities': users_with_cities,
-                'users_with_rain_alerts': users_with_alerts,
-                'total_rain_alerts_sent': total_alerts
-            },
-            'bot_token_configured': bool(Config.BOT_TOKEN),
-            'rain_alerts_active': '24/7',
-            'cron_jobs': 'active'
-        }), 200
+        db.ping()
     except Exception as e:
-        return jsonify({'status': 'error', 'error': str(e)}), 500
+        logger.error(f"❌ Readiness check failed: {e}")
+        return ojson({'status': 'unavailable', 'reason': 'database'}, 503)
+    
+    if all(q.full() for q in UPDATE_QUEUES):
+        return ojson({'status': 'unavailable', 'reason': 'update queue full'}, 503)
+    return _READY_RESPONSE
+
+# /ping body for the current wall-clock second: (second, bytes)
+_ping_cache = (None, b'')
+
+def _ping_body():
+    """Serialized /ping body, rebuilt only when the second rolls over."""
+    global _ping_cache
+    second = int(time.time())
+    if _ping_cache[0] != second:
+        # time.strftime is C-level; the timestamp has second resolution
+        timestamp = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(second))
+        _ping_cache = (second, orjson.dumps({'status': 'pong', 'timestamp': timestamp}))
+    return _ping_cache[1]
 
 @app.route('/ping')
 def ping():
-    return jsonify({'status': 'pong', 'timestamp': datetime.now().isoformat()}), 200
+    return app.response_class(_ping_body(), mimetype='application/json')
 
 # ========== START SERVER ==========
+# Runs at import, so gunicorn workers log the same checks as app.run
+db.start_maintenance()
+
+if not Config.BOT_TOKEN:
+    logger.error("❌ CRITICAL ERROR: BOT_TOKEN is not set!")
+    # home() serves this instead (a second '/' route would never match)
+    _HOME_RESPONSE = app.response_class(
+        response="""
+        <html>
+        <body style="font-family: Arial, sans-serif; padding: 20px;">
+            <h1>❌ Configuration Error</h1>
+            <p>BOT_TOKEN is not set in environment variables.</p>
+        </body>
+        </html>
+        """.encode('utf-8'),
+        status=200,
+        mimetype='text/html',
+        direct_passthrough=True
+    )
+else:
+    logger.info(f"✅ BOT_TOKEN is set (length: {len(Config.BOT_TOKEN)})")
+    logger.info(f"🚀 Starting server on port {Config.PORT}")
+    logger.info(f"💾 Database initialized: users.db")
+    logger.info(f"🌧️ Rain alerts active 24/7")
+    logger.info(f"⏰ Morning reports at 8:00 AM")
+    logger.info(f"🌐 Webhook mode active")
+    logger.info(f"🔒 Cron job signature configured")
+
 if __name__ == '__main__':
-    # Initialize database
-    init_database()
-    
-    if not Config.BOT_TOKEN:
-        logger.error("❌ CRITICAL ERROR: BOT_TOKEN is not set!")
-        @app.route('/')
-        def error_home():
-            return """
-            <html>
-            <body style="font-family: Arial, sans-serif; padding: 20px;">
-                <h1>❌ Configuration Error</h1>
-                <p>BOT_TOKEN is not set in environment variables.</p>
-            </body>
-            </html>
-            """
-    else:
-        logger.info(f"✅ BOT_TOKEN is set (length: {len(Config.BOT_TOKEN)})")
-        logger.info(f"🚀 Starting server on port {Config.PORT}")
-        logger.info(f"💾 Database initialized: users.db")
-        logger.info(f"🌧️ Rain alerts active 24/7")
-        logger.info(f"⏰ Morning reports at 8:00 AM")
-        logger.info(f"🌐 Webhook mode active")
-        logger.info(f"🔒 Cron job signature configured")
-    
-    app.run(host='0.0.0.0', port=Config.PORT, debug=False)
\ No newline at end of file
+    # Local development only; production runs under gunicorn (see Procfile)
+    if Config.IS_RENDER:
+        logger.warning("⚠️ Running Flask's development server on Render, use the Procfile gunicorn command")
+    app.run(host='0.0.0.0', port=Config.PORT, debug=False, threaded=True)
@@ -1,10 +1,10 @@
 import logging
-import time
 import pytz
-import sqlite3
 from datetime import datetime
-from telegram import Bot
+from concurrent.futures import ThreadPoolExecutor
 from config import Config
+from database import db
+from telegram_client import BROADCAST_WORKERS, send_broadcast_message
 from weather_service import get_complete_weather_report
 
 # Configure logging
@@ -14,108 +14,96 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def get_all_users_with_cities():
-    """Ottieni tutti gli utenti con città salvate."""
+def get_user_groups():
+    """Ottieni gli utenti con città salvata, raggruppati per (città, lingua) direttamente in SQL."""
     try:
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id, city FROM users WHERE city IS NOT NULL AND city != ""')
-        users = cursor.fetchall()
-        conn.close()
-        return {str(user[0]): user[1] for user in users}
+        return db.get_city_language_groups()
     except Exception as e:
         logger.error(f"Errore nel recupero utenti con città: {e}")
         return {}
 
-def get_user_language(user_id):
-    """Ottieni lingua utente."""
+# Message templates, formatted once per (city, language) group
+MORNING_GREETINGS = {
+    'it': "🌅 *Buongiorno!* Ecco le previsioni per {city}:\n\n",
+    'en': "🌅 *Good morning!* Here's the forecast for {city}:\n\n"
+}
+
+MORNING_ERRORS = {
+    'it': "⚠️ Non sono riuscito a recuperare le previsioni per {city} questa mattina.\n\n"
+          "Controlla che il nome della città sia corretto o salva una nuova città con /salvacitta",
+    'en': "⚠️ I couldn't retrieve the forecast for {city} this morning.\n\n"
+          "Please check if the city name is correct or save a new city with /savecity"
+}
+
+def build_group_message(city, lang):
+    """Fetch the report once for a (city, language) group. Returns (message, success)."""
     try:
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT language FROM users WHERE user_id = ?', (str(user_id),))
-        result = cursor.fetchone()
-        conn.close()
-        return result[0] if result else 'en'
+        # Get weather report (includes current + 24h + 5-day)
+        result = get_complete_weather_report(city, lang)
+        success = result['success']
+    except Exception as e:
+        logger.error(f"❌ Error getting weather for {city}: {e}")
+        success = False
+    
+    if success:
+        # Format morning message
+        greeting = MORNING_GREETINGS.get(lang, MORNING_GREETINGS['en'])
+        return greeting.format(city=city) + result['message'], True
+    
+    logger.warning(f"⚠️ Could not get weather for {city} ({lang})")
+    
+    # Error message for the users of this group
+    return MORNING_ERRORS.get(lang, MORNING_ERRORS['en']).format(city=city), False
+
+def send_user_report(user_id_str, message, success):
+    """Send a prepared morning message to one user. Returns True if a report was delivered."""
+    try:
+        user_id = int(user_id_str)
+        
+        # Error texts are plain but echo the city name
+        if not send_broadcast_message(Config.BOT_TOKEN, user_id, message, markdown=None if success else False):
+            logger.error(f"❌ Telegram rejected morning message for user {user_id}")
+            return False
+        
+        if success:
+            logger.info(f"✅ Sent morning report to user {user_id}")
+        return success
+        
     except Exception as e:
-        logger.error(f"Errore nel recupero lingua: {e}")
-        return 'en'
+        logger.error(f"❌ Error processing user {user_id_str}: {e}")
+        return False
 
 def send_morning_reports():
     """Send morning weather reports to all users with saved cities."""
     try:
-        bot = Bot(token=Config.BOT_TOKEN)
-        
-        # Get all users with saved cities FROM DATABASE
-        users_with_cities = get_all_users_with_cities()
+        # Users sharing city and language get the same message: fetch it once per group
+        groups = get_user_groups()
         
-        if not users_with_cities:
+        if not groups:
             logger.info("ℹ️ No users with saved cities found in database")
             return
         
+        total_users = sum(len(user_ids) for user_ids in groups.values())
+        
         # Italian timezone
         rome_tz = pytz.timezone(Config.TIMEZONE)
         current_time = datetime.now(rome_tz)
         
-        logger.info(f"📨 Preparing to send morning reports to {len(users_with_cities)} users")
+        logger.info(f"📨 Preparing to send morning reports to {total_users} users ({len(groups)} city/language groups)")
         
-        successful_sends = 0
-        failed_sends = 0
+        # Fetches and sends are I/O bound: run them concurrently, the shared
+        # limiter in telegram_client keeps us under Telegram's rate limit
+        with ThreadPoolExecutor(max_workers=BROADCAST_WORKERS, thread_name_prefix='morning') as pool:
+            messages = dict(zip(groups, pool.map(lambda key: build_group_message(*key), groups)))
+            jobs = [
+                (user_id_str, *messages[key])
+                for key, user_ids in groups.items()
+                for user_id_str in user_ids
+            ]
+            results = list(pool.map(lambda job: send_user_report(*job), jobs))
         
-        for user_id_str, city in users_with_cities.items():
-            try:
-                user_id = int(user_id_str)
-                lang = get_user_language(user_id_str)
-                
-                logger.info(f"📧 Processing user {user_id} for city {city}, language {lang}")
-                
-                # Get weather report (includes current + 24h + 5-day)
-                result = get_complete_weather_report(city, lang)
-                
-                if result['success']:
-                    # Format morning message
-                    if lang == 'it':
-                        morning_greeting = f"🌅 *Buongiorno!* Ecco le previsioni per {city}:\n\n"
-                    else:
-                        morning_greeting = f"🌅 *Good morning!* Here's the forecast for {city}:\n\n"
-                    
-                    full_message = morning_greeting + result['message']
-                    
-                    # Send message
-                    bot.send_message(
-                        chat_id=user_id,
-                        text=full_message,
-                        parse_mode='Markdown'
-                    )
-                    
-                    successful_sends += 1
-                    logger.info(f"✅ Sent morning report to user {user_id} for {city}")
-                    
-                    # Small delay to avoid rate limiting
-                    time.sleep(0.3)
-                    
-                else:
-                    logger.warning(f"⚠️ Could not get weather for {city} (user {user_id})")
-                    failed_sends += 1
-                    
-                    # Send error message to user
-                    error_msg = {
-                        'it': f"⚠️ Non sono riuscito a recuperare le previsioni per {city} questa mattina.\n\n"
-                              f"Controlla che il nome della città sia corretto o salva una nuova città con /salvacitta",
-                        'en': f"⚠️ I couldn't retrieve the forecast for {city} this morning.\n\n"
-                              f"Please check if the city name is correct or save a new city with /savecity"
-                    }
-                    
-                    try:
-                        bot.send_message(
-                            chat_id=user_id,
-                            text=error_msg.get(lang, error_msg['en'])
-                        )
-                    except Exception as e:
-                        logger.error(f"❌ Failed to send error message to user {user_id}: {e}")
-                    
-            except Exception as e:
-                logger.error(f"❌ Error processing user {user_id_str}: {e}")
-                failed_sends += 1
+        successful_sends = sum(results)
+        failed_sends = len(results) - successful_sends
         
         # Log summary
         logger.info(f"📊 Morning report summary:")
@@ -125,23 +113,17 @@ def send_morning_reports():
         
         # Send admin summary if enabled
         if Config.ADMIN_USER_ID and (successful_sends + failed_sends) > 0:
-            try:
-                summary_msg = (
-                    f"📊 *Morning Report Summary*\n"
-                    f"Time: {current_time.strftime('%H:%M %d/%m/%Y')}\n"
-                    f"Users with saved cities: {len(users_with_cities)}\n"
-                    f"✅ Successful: {successful_sends}\n"
-                    f"❌ Failed: {failed_sends}\n"
-                    f"📨 Total attempted: {successful_sends + failed_sends}"
-                )
-                
-                bot.send_message(
-                    chat_id=int(Config.ADMIN_USER_ID),
-                    text=summary_msg,
-                    parse_mode='Markdown'
-                )
-            except Exception as e:
-                logger.error(f"❌ Failed to send admin summary: {e}")
+            summary_msg = (
+                f"📊 *Morning Report Summary*\n"
+                f"Time: {current_time.strftime('%H:%M %d/%m/%Y')}\n"
+                f"Users with saved cities: {total_users}\n"
+                f"✅ Successful: {successful_sends}\n"
+                f"❌ Failed: {failed_sends}\n"
+                f"📨 Total attempted: {successful_sends + failed_sends}"
+            )
+            
+            if not send_broadcast_message(Config.BOT_TOKEN, int(Config.ADMIN_USER_ID), summary_msg):
+                logger.error(f"❌ Failed to send admin summary")
                 
     except Exception as e:
         logger.error(f"❌ Critical error in morning reports: {e}")
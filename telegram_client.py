@@ -0,0 +1,90 @@
+"""
+Telegram Bot API client shared by the webhook and the cron jobs.
+All calls go through one keep-alive session so the TLS connection to
+api.telegram.org is reused instead of being renegotiated per message.
+"""
+
+import logging
+import time
+import orjson
+import requests
+from threading import Lock
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+API_URL = "https://api.telegram.org/bot{token}/{method}"
+
+# Characters that make Telegram's Markdown parser do anything
+_MD_CHARS = frozenset('*_`[')
+
+# Fields shared by every sendMessage call; forecasts never need link previews
+_SEND_BASE = {'disable_web_page_preview': True}
+
+# Payloads are serialized with orjson, so the header is set by hand
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# (connect, read): a dead connection fails fast instead of holding a sender
+# thread for the whole read timeout
+SEND_TIMEOUT = (3.05, 10)
+
+SESSION = requests.Session()
+# Sized for the cron fan-out (see BROADCAST_WORKERS)
+SESSION.mount('https://', HTTPAdapter(pool_connections=10, pool_maxsize=50))
+
+# Cron jobs send from this many threads; Telegram allows ~30 messages/second
+BROADCAST_WORKERS = 32
+BROADCAST_RATE = 30
+
+class RateLimiter:
+    """Token bucket shared by all sender threads: at most `rate` calls per second."""
+    
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.lock = Lock()
+    
+    def acquire(self):
+        """Block until a token is available, then take it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+BROADCAST_LIMITER = RateLimiter(BROADCAST_RATE)
+
+def send_message(token, chat_id, text, reply_markup=None, markdown=None):
+    """Send a message to a Telegram chat.
+    
+    markdown=None sends parse_mode only if the text contains markup; pass
+    False for plain text that echoes user input (e.g. city names with '_').
+    """
+    try:
+        url = API_URL.format(token=token, method='sendMessage')
+        data = {**_SEND_BASE, 'chat_id': chat_id, 'text': text}
+        # Plain text skips the server-side Markdown pass
+        if markdown is None:
+            markdown = not _MD_CHARS.isdisjoint(text)
+        if markdown:
+            data['parse_mode'] = 'Markdown'
+        if reply_markup:
+            data['reply_markup'] = reply_markup
+
+        response = SESSION.post(url, data=orjson.dumps(data), headers=_JSON_HEADERS, timeout=SEND_TIMEOUT)
+        return orjson.loads(response.content)
+    except Exception as e:
+        logger.error(f"Failed to send message: {e}")
+        return None
+
+def send_broadcast_message(token, chat_id, text, markdown=None):
+    """Send one message of a bulk job, respecting the global rate limit."""
+    BROADCAST_LIMITER.acquire()
+    response = send_message(token, chat_id, text, markdown=markdown)
+    return bool(response and response.get('ok'))
@@ -1,97 +1,190 @@
-import json
+"""
+User preferences backed by the SQLite users table.
+Each helper is a single statement on users.db (WAL mode), so updates no
+longer rewrite a whole JSON file and concurrent workers don't race on it.
+"""
+
 import os
+import time
 import logging
+import orjson
+from collections import OrderedDict
 from threading import Lock
+from database import db
 
 logger = logging.getLogger(__name__)
 
+# Legacy JSON store, imported into SQLite once if still present
 USER_PREFS_FILE = 'user_preferences.json'
-PREFS_LOCK = Lock()
-
-def load_user_prefs():
-    """Load user preferences from file."""
-    with PREFS_LOCK:
-        if os.path.exists(USER_PREFS_FILE):
-            try:
-                with open(USER_PREFS_FILE, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-            except Exception as e:
-                logger.error(f"Error loading preferences: {e}")
-                data = {}
-        else:
-            data = {}
-    
-    # GARANTISCI che queste chiavi esistano sempre
-    if 'cities' not in data:
-        data['cities'] = {}
-    if 'rain_alerts' not in data:
-        data['rain_alerts'] = {}
+
+def _migrate_json_prefs():
+    """Move preferences from the old JSON file into the database."""
+    if not os.path.exists(USER_PREFS_FILE):
+        return
+
+    try:
+        with open(USER_PREFS_FILE, 'rb') as f:
+            data = orjson.loads(f.read())
+    except Exception as e:
+        logger.error(f"Error loading legacy preferences: {e}")
+        return
+
+    cities = data.get('cities', {})
+    rain_alerts = data.get('rain_alerts', {})
+    languages = {
+        user_id: lang for user_id, lang in data.items()
+        if user_id not in ('cities', 'rain_alerts')
+    }
+
+    user_ids = set(languages) | set(cities) | set(rain_alerts)
+    # Insert-only: users already in SQLite have newer data than the JSON file
+    inserted = db.import_users(
+        (user_id, languages.get(user_id, 'en'), cities.get(user_id), rain_alerts.get(user_id, False))
+        for user_id in user_ids
+    )
+
+    os.replace(USER_PREFS_FILE, USER_PREFS_FILE + '.migrated')
+    logger.info(f"✅ Migrated preferences for {inserted} of {len(user_ids)} users to database")
+
+_migrate_json_prefs()
+
+# ========== USER ROW CACHE ==========
+# Every update reads the language and most commands the city too; keep the
+# whole row for a short while. Writers below drop the entry.
+USER_CACHE_TTL = 60
+USER_CACHE_SIZE = 4096  # least recently used rows are dropped beyond this
+_user_cache = OrderedDict()
+_user_cache_lock = Lock()
+# Global write counter: a read only caches its row if no write landed
+# while it was querying, so a pre-write row can't outlive the invalidation.
+# One int instead of a per-user map, at the cost of the odd uncached read.
+_user_writes = 0
+
+def _get_cached_user(user_id):
+    """Return the user's row (or None), hitting the database at most once per TTL."""
+    key = str(user_id)
+    now = time.monotonic()
+    with _user_cache_lock:
+        entry = _user_cache.get(key)
+        if entry and now - entry[0] < USER_CACHE_TTL:
+            _user_cache.move_to_end(key)
+            return entry[1]
+        writes = _user_writes
     
-    return data
+    user = db.get_user(key)
+    with _user_cache_lock:
+        if _user_writes == writes:
+            _user_cache[key] = (now, user)
+            _user_cache.move_to_end(key)
+            if len(_user_cache) > USER_CACHE_SIZE:
+                _user_cache.popitem(last=False)
+    return user
+
+def _invalidate_user(user_id):
+    """Forget the cached row after a write and void reads still in flight."""
+    global _user_writes
+    with _user_cache_lock:
+        _user_cache.pop(str(user_id), None)
+        _user_writes += 1
 
-def save_user_prefs(prefs):
-    """Save user preferences to file."""
-    with PREFS_LOCK:
-        try:
-            with open(USER_PREFS_FILE, 'w', encoding='utf-8') as f:
-                json.dump(prefs, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            logger.error(f"Error saving preferences: {e}")
+# Defaults for a chat that has no row yet
+_DEFAULT_PREFS = {'language': 'en', 'city': None, 'rain_alerts': False}
+
+def get_user_prefs(user_id):
+    """Get language, city and rain alerts status from a single row lookup."""
+    try:
+        user = _get_cached_user(user_id)
+        if not user:
+            return dict(_DEFAULT_PREFS)
+        return {
+            'language': user['language'] or 'en',
+            'city': user['city'],
+            'rain_alerts': user['rain_alerts']
+        }
+    except Exception as e:
+        logger.error(f"Error getting user preferences: {e}")
+        return dict(_DEFAULT_PREFS)
 
 def get_user_language(user_id):
     """Get user's language preference."""
-    prefs = load_user_prefs()
-    return prefs.get(str(user_id), 'en')
+    try:
+        user = _get_cached_user(user_id)
+        return user['language'] if user else 'en'
+    except Exception as e:
+        logger.error(f"Error getting user language: {e}")
+        return 'en'
 
 def set_user_language(user_id, lang):
     """Set user's language preference."""
-    prefs = load_user_prefs()
-    prefs[str(user_id)] = lang
-    save_user_prefs(prefs)
-    return True
+    try:
+        result = db.set_user_language(user_id, lang)
+        # After the write commits; the counter bump stops in-flight reads re-caching the old row
+        _invalidate_user(user_id)
+        return result
+    except Exception as e:
+        logger.error(f"Error setting user language: {e}")
+        return False
 
 def get_user_city(user_id):
     """Get user's saved city."""
-    prefs = load_user_prefs()
-    return prefs.get('cities', {}).get(str(user_id))
+    try:
+        user = _get_cached_user(user_id)
+        return user['city'] if user else None
+    except Exception as e:
+        logger.error(f"Error getting user city: {e}")
+        return None
 
 def save_user_city(user_id, city):
     """Save user's city."""
-    prefs = load_user_prefs()
-    
-    if 'cities' not in prefs:
-        prefs['cities'] = {}
-    
-    prefs['cities'][str(user_id)] = city
-    save_user_prefs(prefs)
-    return True
+    try:
+        result = db.set_user_city(user_id, city)
+        _invalidate_user(user_id)
+        return result
+    except Exception as e:
+        logger.error(f"Error saving user city: {e}")
+        return False
 
 def get_rain_alerts_status(user_id):
     """Get user's rain alerts status."""
-    prefs = load_user_prefs()
-    return prefs.get('rain_alerts', {}).get(str(user_id), False)
+    try:
+        user = _get_cached_user(user_id)
+        return user['rain_alerts'] if user else False
+    except Exception as e:
+        logger.error(f"Error getting rain alerts status: {e}")
+        return False
 
 def set_rain_alerts_status(user_id, status):
     """Set user's rain alerts status."""
-    prefs = load_user_prefs()
-    
-    if 'rain_alerts' not in prefs:
-        prefs['rain_alerts'] = {}
-    
-    prefs['rain_alerts'][str(user_id)] = status
-    save_user_prefs(prefs)
-    return True
+    try:
+        result = db.set_rain_alerts(user_id, status)
+        _invalidate_user(user_id)
+        return result
+    except Exception as e:
+        logger.error(f"Error setting rain alerts status: {e}")
+        return False
+
+def update_user_prefs(user_id, language=None, city=None, rain_alerts=None):
+    """Set several preferences with a single write (None = unchanged)."""
+    try:
+        result = db.update_user(user_id, language, city, rain_alerts)
+        _invalidate_user(user_id)
+        return result
+    except Exception as e:
+        logger.error(f"Error updating user preferences: {e}")
+        return False
 
 def get_all_users_with_cities():
     """Get all users with saved cities."""
-    prefs = load_user_prefs()
-    return prefs.get('cities', {})
+    try:
+        return db.get_all_users_with_cities()
+    except Exception as e:
+        logger.error(f"Error getting users with cities: {e}")
+        return {}
 
 def get_all_users_with_rain_alerts():
     """Get all users with rain alerts enabled."""
-    prefs = load_user_prefs()
-    return {
-        user_id: status 
-        for user_id, status in prefs.get('rain_alerts', {}).items() 
-        if status and user_id in prefs.get('cities', {})
-    }
\ No newline at end of file
+    try:
+        return db.get_all_users_with_rain_alerts()
+    except Exception as e:
+        logger.error(f"Error getting users with rain alerts: {e}")
+        return {}
@@ -3,11 +3,15 @@ Weather Service Module with Enhanced Rain Alerts
 Provides complete weather reports including current conditions, 24-hour summary, and 5-day forecast
 """
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta
 import pytz
 import time
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from threading import Lock
+from database import db
 
 # Translation dictionaries
 TRANSLATIONS = {
@@ -116,53 +120,115 @@ WEATHER_DESCRIPTIONS = {
     }
 }
 
+# Weather codes for rain, drizzle, showers and thunderstorms
+RAIN_CODES = frozenset({51, 53, 55, 61, 63, 65, 80, 81, 82, 95, 96, 99})
+
+# Short weekday names, indexed by datetime.weekday()
+DAY_NAMES = {
+    'en': ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'),
+    'it': ('Lun', 'Mar', 'Mer', 'Gio', 'Ven', 'Sab', 'Dom')
+}
+
+# Keep-alive session for Open-Meteo (geocoding + forecast), like telegram_client.SESSION
+METEO_SESSION = requests.Session()
+METEO_SESSION.mount('https://', HTTPAdapter(pool_connections=10, pool_maxsize=20))
+
 # Cache per evitare troppe richieste
 WEATHER_CACHE_DURATION = 300  # 5 minutes
-COORDINATES_CACHE_DURATION = 3600  # 1 hour
+# Open-Meteo refreshes its models every ~15 minutes; raw forecasts can live longer
+FORECAST_CACHE_DURATION = 600  # 10 minutes
+FORECAST_CACHE_SIZE = 1024
+# Coordinates never change: keep them (LRU) in memory and in the geocache table
+COORDINATES_CACHE_SIZE = 4096
 
 class WeatherCache:
     def __init__(self):
-        self.coordinates_cache = {}
+        self.coordinates_cache = OrderedDict()
+        self.coordinates_lock = Lock()
         self.weather_cache = {}
+        self.weather_lock = Lock()
+        # One lock per location so a burst for one city makes a single request
+        self.weather_key_locks = defaultdict(Lock)
     
     def get_coordinates(self, city_name):
         """Get cached coordinates or fetch new ones."""
         cache_key = city_name.lower().strip()
         
-        if cache_key in self.coordinates_cache:
-            data, timestamp = self.coordinates_cache[cache_key]
-            if time.time() - timestamp < COORDINATES_CACHE_DURATION:
+        with self.coordinates_lock:
+            data = self.coordinates_cache.get(cache_key)
+            if data:
+                self.coordinates_cache.move_to_end(cache_key)
                 return data
         
-        # Fetch new coordinates
-        lat, lon, region = self._fetch_coordinates(city_name)
-        if lat is not None:
-            self.coordinates_cache[cache_key] = ((lat, lon, region), time.time())
+        # Known from a previous run?
+        try:
+            data = db.get_geocode(cache_key)
+        except Exception as e:
+            print(f"Geocache read error: {e}")
+            data = None
+        
+        if not data:
+            # Fetch new coordinates
+            lat, lon, region = self._fetch_coordinates(city_name)
+            if lat is None:
+                return lat, lon, region
+            data = (lat, lon, region)
+            try:
+                db.save_geocode(cache_key, *data)
+            except Exception as e:
+                print(f"Geocache write error: {e}")
         
-        return lat, lon, region
+        data = tuple(data)
+        with self.coordinates_lock:
+            self.coordinates_cache[cache_key] = data
+            if len(self.coordinates_cache) > COORDINATES_CACHE_SIZE:
+                self.coordinates_cache.popitem(last=False)
+        
+        return data
     
     def get_weather(self, lat, lon):
         """Get cached weather or fetch new data."""
-        cache_key = f"{lat:.2f},{lon:.2f}"
+        cache_key = (round(lat, 2), round(lon, 2))
         
-        if cache_key in self.weather_cache:
-            data, timestamp = self.weather_cache[cache_key]
-            if time.time() - timestamp < WEATHER_CACHE_DURATION:
-                return data
-        
-        # Fetch new weather
-        weather_data = self._fetch_weather(lat, lon)
+        weather_data = self._fresh_weather(cache_key)
         if weather_data:
-            self.weather_cache[cache_key] = (weather_data, time.time())
+            return weather_data
+        
+        with self.weather_lock:
+            key_lock = self.weather_key_locks[cache_key]
+        
+        with key_lock:
+            # Another thread may have fetched it while we waited
+            weather_data = self._fresh_weather(cache_key)
+            if weather_data:
+                return weather_data
+            
+            # Fetch new weather
+            weather_data = self._fetch_weather(lat, lon)
+            if weather_data:
+                with self.weather_lock:
+                    self.weather_cache.pop(cache_key, None)
+                    if len(self.weather_cache) >= FORECAST_CACHE_SIZE:
+                        oldest = next(iter(self.weather_cache))
+                        del self.weather_cache[oldest]
+                        self.weather_key_locks.pop(oldest, None)
+                    self.weather_cache[cache_key] = (weather_data, time.time())
         
         return weather_data
     
+    def _fresh_weather(self, cache_key):
+        entry = self.weather_cache.get(cache_key)
+        if entry and time.time() - entry[1] < FORECAST_CACHE_DURATION:
+            return entry[0]
+        return None
+    
     def _fetch_coordinates(self, city_name):
         """Fetch coordinates from API."""
-        url = f"https://geocoding-api.open-meteo.com/v1/search?name={city_name}&count=1&language=it"
+        url = "https://geocoding-api.open-meteo.com/v1/search"
+        params = {'name': city_name, 'count': 1, 'language': 'it'}
         try:
-            response = requests.get(url, timeout=5)
-            data = response.json()
+            response = METEO_SESSION.get(url, params=params, timeout=5)
+            data = orjson.loads(response.content)
             if data.get('results'):
                 location = data['results'][0]
                 return location['latitude'], location['longitude'], location.get('admin1', '')
@@ -187,13 +253,14 @@ class WeatherCache:
         max_retries = 2
         for attempt in range(max_retries):
             try:
-                response = requests.get(url, params=params, timeout=8)
+                response = METEO_SESSION.get(url, params=params, timeout=8)
                 if response.status_code == 429:  # Too Many Requests
                     wait_time = (attempt + 1) * 2  # Exponential backoff
                     print(f"Rate limited, waiting {wait_time} seconds...")
                     time.sleep(wait_time)
                     continue
-                return response.json()
+                # The hourly forecast is the biggest payload we parse: orjson, not stdlib json
+                return orjson.loads(response.content)
             except Exception as e:
                 print(f"Weather API error (attempt {attempt + 1}): {e}")
                 if attempt < max_retries - 1:
@@ -249,7 +316,7 @@ def get_detailed_rain_alert(hourly_data, tz_string='Europe/Rome', lang='en', hou
             if precip >= 0.1 and prob >= 20:
                 is_rain_event = True
             # Check weather code for rain (codes for rain, drizzle, showers, thunderstorm)
-            elif code in [51, 53, 55, 61, 63, 65, 80, 81, 82, 95, 96, 99]:
+            elif code in RAIN_CODES:
                 is_rain_event = True
             
             if is_rain_event:
@@ -361,7 +428,7 @@ def create_detailed_rain_message(city, region, weather_data, lang='en'):
         
         total_current = current_precip + current_rain + current_showers
         
-        if total_current > 0 or current_code in [51, 53, 55, 61, 63, 65, 80, 81, 82, 95, 96, 99]:
+        if total_current > 0 or current_code in RAIN_CODES:
             if lang == 'it':
                 message_parts.append(f"⚠️ **ATTENZIONE: STA PIOVENDO ORA!**")
                 message_parts.append(f"Precipitazioni attuali: {total_current:.1f} mm")
@@ -437,6 +504,14 @@ def get_day_part(hour):
     else:
         return 'night'
 
+# Summary rows in display order: (part of day, icon, hours label)
+DAY_PARTS = (
+    ('morning', '🌅', '6-12'),
+    ('afternoon', '☀️', '12-18'),
+    ('evening', '🌇', '18-22'),
+    ('night', '🌙', '22-6'),
+)
+
 def get_24h_summary(hourly_forecast, lang='en'):
     """Create a 24-hour summary from hourly forecast."""
     if not hourly_forecast:
@@ -445,62 +520,63 @@ def get_24h_summary(hourly_forecast, lang='en'):
     T = TRANSLATIONS[lang]
     summary_parts = []
     
-    # Group by time of day
-    morning_hours = [h for h in hourly_forecast if 6 <= h['hour'] < 12]
-    afternoon_hours = [h for h in hourly_forecast if 12 <= h['hour'] < 18]
-    evening_hours = [h for h in hourly_forecast if 18 <= h['hour'] < 22]
-    night_hours = [h for h in hourly_forecast if h['hour'] < 6 or h['hour'] >= 22]
-    
-    # Morning (6-12)
-    if morning_hours:
-        morning_temps = [h['temperature'] for h in morning_hours if h['temperature'] is not None]
-        morning_precip = sum(h['precipitation'] for h in morning_hours)
-        
-        if morning_temps:
-            morning_avg = sum(morning_temps) / len(morning_temps)
-            if lang == 'it':
-                summary_parts.append(f"• 🌅 **{T['morning']} (6-12)**: ~{morning_avg:.0f}°C, {morning_precip:.1f}mm")
-            else:
-                summary_parts.append(f"• 🌅 **{T['morning']} (6-12)**: ~{morning_avg:.0f}°C, {morning_precip:.1f}mm")
-    
-    # Afternoon (12-18)
-    if afternoon_hours:
-        afternoon_temps = [h for h in afternoon_hours if h['temperature'] is not None]
-        afternoon_precip = sum(h['precipitation'] for h in afternoon_hours)
-        
-        if afternoon_temps:
-            afternoon_avg = sum(afternoon_temps) / len(afternoon_temps)
-            if lang == 'it':
-                summary_parts.append(f"• ☀️ **{T['afternoon']} (12-18)**: ~{afternoon_avg:.0f}°C, {afternoon_precip:.1f}mm")
-            else:
-                summary_parts.append(f"• ☀️ **{T['afternoon']} (12-18)**: ~{afternoon_avg:.0f}°C, {afternoon_precip:.1f}mm")
-    
-    # Evening (18-22)
-    if evening_hours:
-        evening_temps = [h for h in evening_hours if h['temperature'] is not None]
-        evening_precip = sum(h['precipitation'] for h in evening_hours)
-        
-        if evening_temps:
-            evening_avg = sum(evening_temps) / len(evening_temps)
-            if lang == 'it':
-                summary_parts.append(f"• 🌇 **{T['evening']} (18-22)**: ~{evening_avg:.0f}°C, {evening_precip:.1f}mm")
-            else:
-                summary_parts.append(f"• 🌇 **{T['evening']} (18-22)**: ~{evening_avg:.0f}°C, {evening_precip:.1f}mm")
-    
-    # Night (22-6)
-    if night_hours:
-        night_temps = [h for h in night_hours if h['temperature'] is not None]
-        night_precip = sum(h['precipitation'] for h in night_hours)
-        
-        if night_temps:
-            night_avg = sum(night_temps) / len(night_temps)
-            if lang == 'it':
-                summary_parts.append(f"• 🌙 **{T['night']} (22-6)**: ~{night_avg:.0f}°C, {night_precip:.1f}mm")
-            else:
-                summary_parts.append(f"• 🌙 **{T['night']} (22-6)**: ~{night_avg:.0f}°C, {night_precip:.1f}mm")
+    # Group by time of day in a single pass
+    part_temps = defaultdict(list)
+    part_precip = defaultdict(float)
+    for h in hourly_forecast:
+        part = get_day_part(h['hour'])
+        part_precip[part] += h['precipitation'] or 0
+        if h['temperature'] is not None:
+            part_temps[part].append(h['temperature'])
+    
+    for part, icon, hours in DAY_PARTS:
+        temps = part_temps.get(part)
+        if temps:
+            avg = sum(temps) / len(temps)
+            summary_parts.append(f"• {icon} **{T[part]} ({hours})**: ~{avg:.0f}°C, {part_precip[part]:.1f}mm")
     
     return "\n".join(summary_parts)
 
+# Fixed lines of create_weather_message, per language
+WEATHER_MESSAGE_TEXTS = {
+    'en': {
+        'title': "**{icon} Weather for {city}**",
+        'updated': "*Updated at {time}*",
+        'rain_line': "• {icon} **{part}**: {intensity} rain around {time}",
+        'raining_now': "⚠️ **RAINING NOW!**\nCurrent precipitation: {precip:.1f} mm\nCondition: {desc}",
+        'next_24h_suffix': "in the next 24 hours",
+        'temperature': "• Temperature: **{temp}°C**",
+        'humidity': "• Humidity: **{humidity}%**",
+        'no_24h': "⚠️ 24-hour data not available",
+        'no_daily': "⚠️ Daily forecast temporarily unavailable"
+    },
+    'it': {
+        'title': "**{icon} Meteo per {city}**",
+        'updated': "*Aggiornato alle {time}*",
+        'rain_line': "• {icon} **{part}**: Pioggia {intensity} verso le {time}",
+        'raining_now': "⚠️ **STA PIOVENDO ORA!**\nPrecipitazioni attuali: {precip:.1f} mm\nCondizione: {desc}",
+        'next_24h_suffix': "nelle prossime 24 ore",
+        'temperature': "• Temperatura: **{temp}°C**",
+        'humidity': "• Umidità: **{humidity}%**",
+        'no_24h': "⚠️ Dati 24 ore non disponibili",
+        'no_daily': "⚠️ Previsioni giornaliere temporaneamente non disponibili"
+    }
+}
+
+# Rain alert lines in display order: (part of day, icon, first hour, end hour)
+RAIN_PARTS = (
+    ('morning', '🌅', 6, 12),
+    ('afternoon', '☀️', 12, 18),
+    ('evening', '🌇', 18, 24),
+    ('night', '🌙', 0, 6)
+)
+
+def format_rain_time(dt, lang):
+    """Format a rain event time: 24h for Italian, 12h for English."""
+    if lang == 'it':
+        return dt.strftime('%H:%M')
+    return dt.strftime('%I:%M %p').lstrip('0')
+
 def create_weather_message(city, region, weather_data, lang):
     """Format weather data into a user-friendly message with current, 24h summary, and 5-day forecast"""
     if not weather_data:
@@ -519,13 +595,8 @@ def create_weather_message(city, region, weather_data, lang):
     current_icon = WEATHER_ICONS.get(current_code, '🌈')
     current_desc = WEATHER_DESCRIPTIONS[lang].get(current_code, '')
     
-    message_parts = []
-    
-    # Title
-    if lang == 'it':
-        message_parts.append(f"**{current_icon} Meteo per {city}**")
-    else:
-        message_parts.append(f"**{current_icon} Weather for {city}**")
+    M = WEATHER_MESSAGE_TEXTS['it' if lang == 'it' else 'en']
+    message_parts = [M['title'].format(icon=current_icon, city=city)]
     
     # Region
     if region:
@@ -536,16 +607,12 @@ def create_weather_message(city, region, weather_data, lang):
     if update_time and isinstance(update_time, str) and len(update_time) > 10:
         try:
             update_time = update_time.split('T')[1][:5] if 'T' in update_time else update_time[11:16]
-        except:
+        except IndexError:
             update_time = datetime.now(pytz.timezone(timezone)).strftime('%H:%M')
     else:
         update_time = datetime.now(pytz.timezone(timezone)).strftime('%H:%M')
     
-    if lang == 'it':
-        message_parts.append(f"*Aggiornato alle {update_time}*")
-    else:
-        message_parts.append(f"*Updated at {update_time}*")
-    
+    message_parts.append(M['updated'].format(time=update_time))
     message_parts.append("")
     
     # Enhanced Rain Alert Section - SEMPRE ATTIVO 24/7
@@ -553,47 +620,20 @@ def create_weather_message(city, region, weather_data, lang):
         message_parts.append(T['rain_alert'])
         message_parts.append(f"*{T['next_24h']}*")
         
-        # Group by time of day
-        morning_rain = [e for e in rain_events if 6 <= e['hour'] < 12]
-        afternoon_rain = [e for e in rain_events if 12 <= e['hour'] < 18]
-        evening_rain = [e for e in rain_events if 18 <= e['hour'] < 24]
-        night_rain = [e for e in rain_events if e['hour'] < 6]
-        
-        if morning_rain:
-            first = morning_rain[0]
-            if lang == 'it':
-                message_parts.append(f"• 🌅 **{T['morning']}**: Pioggia {first['intensity']} verso le {first['time'].strftime('%H:%M')}")
-            else:
-                message_parts.append(f"• 🌅 **{T['morning']}**: {first['intensity']} rain around {first['time'].strftime('%I:%M %p').lstrip('0')}")
-        
-        if afternoon_rain:
-            first = afternoon_rain[0]
-            if lang == 'it':
-                message_parts.append(f"• ☀️ **{T['afternoon']}**: Pioggia {first['intensity']} verso le {first['time'].strftime('%H:%M')}")
-            else:
-                message_parts.append(f"• ☀️ **{T['afternoon']}**: {first['intensity']} rain around {first['time'].strftime('%I:%M %p').lstrip('0')}")
-        
-        if evening_rain:
-            first = evening_rain[0]
-            if lang == 'it':
-                message_parts.append(f"• 🌇 **{T['evening']}**: Pioggia {first['intensity']} verso le {first['time'].strftime('%H:%M')}")
-            else:
-                message_parts.append(f"• 🌇 **{T['evening']}**: {first['intensity']} rain around {first['time'].strftime('%I:%M %p').lstrip('0')}")
-        
-        if night_rain:
-            first = night_rain[0]
-            if lang == 'it':
-                message_parts.append(f"• 🌙 **{T['night']}**: Pioggia {first['intensity']} verso le {first['time'].strftime('%H:%M')}")
-            else:
-                message_parts.append(f"• 🌙 **{T['night']}**: {first['intensity']} rain around {first['time'].strftime('%I:%M %p').lstrip('0')}")
+        # First rain event of each part of the day
+        for part, icon, start, end in RAIN_PARTS:
+            first = next((e for e in rain_events if start <= e['hour'] < end), None)
+            if first:
+                message_parts.append(M['rain_line'].format(
+                    icon=icon,
+                    part=T[part],
+                    intensity=first['intensity'],
+                    time=format_rain_time(first['time'], lang)
+                ))
         
         # Total accumulation
         total_precip = sum(e['precipitation'] for e in rain_events)
-        if lang == 'it':
-            message_parts.append(f"*{T['total_expected']}: ~{total_precip:.1f} mm*")
-        else:
-            message_parts.append(f"*{T['total_expected']}: ~{total_precip:.1f} mm*")
-        
+        message_parts.append(f"*{T['total_expected']}: ~{total_precip:.1f} mm*")
         message_parts.append("")
     else:
         # Check current rain
@@ -602,23 +642,11 @@ def create_weather_message(city, region, weather_data, lang):
         current_showers = current.get('showers', 0)
         total_current = current_precip + current_rain + current_showers
         
-        if total_current > 0 or current_code in [51, 53, 55, 61, 63, 65, 80, 81, 82, 95, 96, 99]:
-            if lang == 'it':
-                message_parts.append(f"⚠️ **STA PIOVENDO ORA!**")
-                message_parts.append(f"Precipitazioni attuali: {total_current:.1f} mm")
-                message_parts.append(f"Condizione: {current_desc}")
-                message_parts.append("")
-            else:
-                message_parts.append(f"⚠️ **RAINING NOW!**")
-                message_parts.append(f"Current precipitation: {total_current:.1f} mm")
-                message_parts.append(f"Condition: {current_desc}")
-                message_parts.append("")
+        if total_current > 0 or current_code in RAIN_CODES:
+            message_parts.append(M['raining_now'].format(precip=total_current, desc=current_desc))
         else:
-            if lang == 'it':
-                message_parts.append(f"✅ {T['no_significant_rain']} nelle prossime 24 ore")
-            else:
-                message_parts.append(f"✅ {T['no_significant_rain']} in the next 24 hours")
-            message_parts.append("")
+            message_parts.append(f"✅ {T['no_significant_rain']} {M['next_24h_suffix']}")
+        message_parts.append("")
     
     # Current Conditions
     message_parts.append(f"**{T['current_conditions']}**")
@@ -630,18 +658,11 @@ def create_weather_message(city, region, weather_data, lang):
     wind = current.get('wind_speed_10m', 'N/A')
     humidity = current.get('relative_humidity_2m', 'N/A')
     
-    if lang == 'it':
-        message_parts.append(f"• Temperatura: **{temp}°C**")
-        message_parts.append(f"• {T['feels_like']}: **{feels_like}°C**")
-        message_parts.append(f"• {T['wind']}: **{wind} km/h**")
-        if humidity != 'N/A':
-            message_parts.append(f"• Umidità: **{humidity}%**")
-    else:
-        message_parts.append(f"• Temperature: **{temp}°C**")
-        message_parts.append(f"• {T['feels_like']}: **{feels_like}°C**")
-        message_parts.append(f"• {T['wind']}: **{wind} km/h**")
-        if humidity != 'N/A':
-            message_parts.append(f"• Humidity: **{humidity}%**")
+    message_parts.append(M['temperature'].format(temp=temp))
+    message_parts.append(f"• {T['feels_like']}: **{feels_like}°C**")
+    message_parts.append(f"• {T['wind']}: **{wind} km/h**")
+    if humidity != 'N/A':
+        message_parts.append(M['humidity'].format(humidity=humidity))
     
     message_parts.append("")
     
@@ -650,31 +671,15 @@ def create_weather_message(city, region, weather_data, lang):
     
     # Get hourly forecast
     hourly_forecast = get_24h_hourly_forecast(hourly, timezone)
-    
-    if hourly_forecast:
-        summary = get_24h_summary(hourly_forecast, lang)
-        if summary:
-            message_parts.append(summary)
-        else:
-            if lang == 'it':
-                message_parts.append("⚠️ Dati 24 ore non disponibili")
-            else:
-                message_parts.append("⚠️ 24-hour data not available")
-    else:
-        if lang == 'it':
-            message_parts.append("⚠️ Dati 24 ore non disponibili")
-        else:
-            message_parts.append("⚠️ 24-hour data not available")
+    summary = get_24h_summary(hourly_forecast, lang) if hourly_forecast else None
+    message_parts.append(summary or M['no_24h'])
     
     message_parts.append("")
     
     # 5-Day Forecast
     message_parts.append(f"**{T['forecast']}**")
     
-    # Day names
-    day_names_it = ['Lun', 'Mar', 'Mer', 'Gio', 'Ven', 'Sab', 'Dom']
-    day_names_en = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
-    day_names = day_names_it if lang == 'it' else day_names_en
+    day_names = DAY_NAMES['it' if lang == 'it' else 'en']
     
     # Check if we have daily data
     daily_time = daily.get('time', [])
@@ -688,10 +693,8 @@ def create_weather_message(city, region, weather_data, lang):
         for i in range(days_to_show):
             date_str = daily_time[i]
             try:
-                if 'T' in date_str:
-                    date_obj = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-                else:
-                    date_obj = datetime.strptime(date_str, '%Y-%m-%d')
+                # Open-Meteo sends 'YYYY-MM-DD'; fromisoformat also takes full timestamps
+                date_obj = datetime.fromisoformat(date_str)
             except Exception as e:
                 date_obj = datetime.now() + timedelta(days=i)
             
@@ -709,34 +712,22 @@ def create_weather_message(city, region, weather_data, lang):
             else:
                 day_prefix = ""
             
-            if temp_min != 'N/A' and temp_max != 'N/A':
-                try:
-                    if isinstance(temp_min, (int, float)) and isinstance(temp_max, (int, float)):
-                        if lang == 'it':
-                            temp_text = f"{T['min']} {temp_min:.0f}° → {T['max']} **{temp_max:.0f}°**"
-                        else:
-                            temp_text = f"{T['min']} {temp_min:.0f}° → {T['max']} **{temp_max:.0f}°**"
-                    else:
-                        temp_text = f"{temp_min}° / {temp_max}°"
-                except:
-                    temp_text = f"{temp_min}° / {temp_max}°"
+            if isinstance(temp_min, (int, float)) and isinstance(temp_max, (int, float)):
+                temp_text = f"{T['min']} {temp_min:.0f}° → {T['max']} **{temp_max:.0f}°**"
             else:
                 temp_text = f"{temp_min}° / {temp_max}°"
             
             message_parts.append(f"{day_prefix}{day_name} {date_formatted} {day_icon} {temp_text}")
     else:
-        if lang == 'it':
-            message_parts.append("⚠️ Previsioni giornaliere temporaneamente non disponibili")
-        else:
-            message_parts.append("⚠️ Daily forecast temporarily unavailable")
+        message_parts.append(M['no_daily'])
     
     message_parts.append("")
     message_parts.append(f"_{T['data_source']}_")
     
     return "\n".join(message_parts)
 
-def get_complete_weather_report(city, lang='en'):
-    """Main function to get complete weather report for a city"""
+def _build_complete_weather_report(city, lang='en'):
+    """Fetch and format the complete weather report (uncached)"""
     lat, lon, region = get_coordinates(city)
     
     if lat is None:
@@ -750,8 +741,8 @@ def get_complete_weather_report(city, lang='en'):
     message = create_weather_message(city, region, weather_data, lang)
     return {'success': True, 'message': message}
 
-def get_detailed_rain_forecast(city, lang='en'):
-    """Get detailed rain forecast for a city"""
+def _build_detailed_rain_forecast(city, lang='en'):
+    """Fetch and format the detailed rain forecast (uncached)"""
     lat, lon, region = get_coordinates(city)
     
     if lat is None:
@@ -764,4 +755,74 @@ def get_detailed_rain_forecast(city, lang='en'):
     
     # Use the function defined in this module
     message = create_detailed_rain_message(city, region, weather_data, lang)
-    return {'success': True, 'message': message}
\ No newline at end of file
+    return {'success': True, 'message': message}
+
+# ========== REPORT CACHE ==========
+# Formatted reports are reused while the weather data behind them is fresh
+REPORT_CACHE_DURATION = WEATHER_CACHE_DURATION
+REPORT_CACHE_SIZE = 512
+
+class ReportCache:
+    """TTL cache of formatted reports; concurrent misses for one key share a single fetch."""
+    
+    def __init__(self, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.reports = {}
+        self.key_locks = defaultdict(Lock)
+        self.lock = Lock()
+    
+    def _fresh(self, key):
+        entry = self.reports.get(key)
+        if entry and time.time() - entry[1] < self.ttl:
+            return entry[0]
+        return None
+    
+    def get(self, key, build):
+        """Return the cached report for key, or build() it once and cache it on success."""
+        report = self._fresh(key)
+        if report:
+            return report
+        
+        with self.lock:
+            key_lock = self.key_locks[key]
+        
+        with key_lock:
+            # Another thread may have built it while we waited
+            report = self._fresh(key)
+            if report:
+                return report
+            
+            report = build()
+            if report['success']:
+                with self.lock:
+                    self.reports.pop(key, None)
+                    if len(self.reports) >= self.maxsize:
+                        # Dict order is insertion order: drop the oldest entry
+                        oldest = next(iter(self.reports))
+                        del self.reports[oldest]
+                        self.key_locks.pop(oldest, None)
+                    self.reports[key] = (report, time.time())
+            else:
+                # Nothing cached (unknown city, typo, API error): don't keep a
+                # lock per failed key, they come from users' free text
+                with self.lock:
+                    if self.key_locks.get(key) is key_lock:
+                        del self.key_locks[key]
+            return report
+
+report_cache = ReportCache(REPORT_CACHE_DURATION, REPORT_CACHE_SIZE)
+
+def get_complete_weather_report(city, lang='en'):
+    """Main function to get complete weather report for a city"""
+    return report_cache.get(
+        ('full', city.strip(), lang),
+        lambda: _build_complete_weather_report(city, lang)
+    )
+
+def get_detailed_rain_forecast(city, lang='en'):
+    """Get detailed rain forecast for a city"""
+    return report_cache.get(
+        ('rain', city.strip(), lang),
+        lambda: _build_detailed_rain_forecast(city, lang)
+    )